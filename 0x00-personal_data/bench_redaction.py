@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+''' Compare the regex and tokenizer redaction engines
+
+    Usage: ./bench_redaction.py [--lines N] [--repeat N]
+
+    Both engines are first checked for identical output on CORPUS, then
+    timed on generated log lines with an increasing number of fields.
+'''
+
+import argparse
+import timeit
+from typing import List
+from filtered_logger import (PII_FIELDS, RedactingFormatter, filter_datum,
+                             filter_datum_tokens)
+
+
+CORPUS = [
+    'name=egg;email=eggmin@eggsample.com;password=eggcellent;'
+    'date_of_birth=12/12/1986;',
+    'name=Bob; email=bob@dylan.com; ssn=000-123-0000; password=bobbycool;',
+    '[HOLBERTON] user_data INFO 2019-11-19 18:37:59,596: name=***; '
+    'email=nzjoh@example.com; phone=(791) 405-7845; ssn=615-59-4931; '
+    'password=4b1d86c4e6d80d8d; ip=60ed:c396:2ff:244:bbd0:9208:26f2:93ea; '
+    'last_login=2019-11-14 06:14:24; user_agent=Mozilla/5.0;',
+    'name=a\nemail=b;\nphone=c; ip=d;',
+    'username=keep; surname=keep; name=drop; email=',
+    'ip=1.2.3.4; user_agent=curl/7.58; last_login=2019-11-14;',
+    'name==double; email=a=b; phone=; ssn=;;password=x;',
+    '',
+    ';;;',
+    'no fields at all',
+    'foo=x name=y; x-name=y; a:name=b; xname=y; name_x=z;',
+    'a=b=email=c; ip=1 ssn=2 phone=3;',
+]
+
+
+def make_lines(count: int, extra_fields: int) -> List[str]:
+    ''' Generate count log lines with the PII fields and extra_fields
+        non-PII fields
+    '''
+    lines = []
+    for i in range(count):
+        pairs = [f'{f}=value-{f}-{i}' for f in PII_FIELDS]
+        pairs += [f'field_{j}=some-longer-value-{i}-{j}'
+                  for j in range(extra_fields)]
+        lines.append('; '.join(pairs) + ';')
+    return lines
+
+
+def check_corpus() -> None:
+    ''' Assert that both engines agree on every line of CORPUS, with the
+        PII fields and with no fields at all
+    '''
+    for line in CORPUS:
+        for sep in (';', '|'):
+            message = line.replace(';', sep)
+            for fields in (PII_FIELDS, ()):
+                expected = filter_datum(fields, 'xxx', message, sep)
+                actual = filter_datum_tokens(fields, 'xxx', message, sep)
+                assert expected == actual, (message, expected, actual)
+
+
+def main() -> None:
+    ''' Run the corpus check and print timings per engine '''
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--lines', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    check_corpus()
+    print(f'corpus: {len(CORPUS)} lines, engines agree')
+
+    formatters = {engine: RedactingFormatter(PII_FIELDS, engine)
+                  for engine in ('regex', 'tokenizer')}
+    for extra in (0, 5, 20, 50):
+        lines = make_lines(args.lines, extra)
+        timings = {}
+        for engine, formatter in formatters.items():
+            redact = formatter.redact
+            timings[engine] = min(timeit.repeat(
+                lambda: [redact(line) for line in lines],
+                number=1, repeat=args.repeat))
+        avg = sum(map(len, lines)) // len(lines)
+        print(f'{len(PII_FIELDS) + extra:3d} fields, {avg:5d} chars/line: ' +
+              ', '.join(f'{e} {t / len(lines) * 1e6:.2f} us/line'
+                        for e, t in timings.items()) +
+              f' (x{timings["regex"] / timings["tokenizer"]:.2f})')
+
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,96 @@
    6. Check valid password
 '''
 
+import asyncio
 import bcrypt
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Tuple
+
+
+TARGET_MS = 250.0
+MIN_ROUNDS = 10
+MAX_ROUNDS = 16
+
+_calibration = None
+_calibration_lock = threading.Lock()
+_async_hasher = None
+
+
+def calibrate(target_ms: float = None, min_rounds: int = MIN_ROUNDS,
+              max_rounds: int = MAX_ROUNDS) -> dict:
+    '''
+    Benchmarks bcrypt on this host and picks the work factor to use.
+
+    Costs are timed from min_rounds upwards; the highest one whose hash
+    takes at most target_ms milliseconds is kept, never less than
+    min_rounds. The chosen cost is then used by hash_password.
+
+    Arguments:
+    target_ms -- Latency budget per hash (defaults to BCRYPT_TARGET_MS from
+                 the environment, or 250).
+    min_rounds -- Lowest acceptable cost.
+    max_rounds -- Highest cost tried.
+
+    Returns:
+    The calibration report: target_ms, the chosen rounds and the measured
+    timings_ms per cost.
+    '''
+    global _calibration
+    if target_ms is None:
+        target_ms = float(os.getenv('BCRYPT_TARGET_MS', TARGET_MS))
+    rounds, timings = min_rounds, {}
+    for cost in range(min_rounds, max_rounds + 1):
+        start = time.perf_counter()
+        bcrypt.hashpw(b'calibration', bcrypt.gensalt(cost))
+        timings[cost] = (time.perf_counter() - start) * 1000
+        if timings[cost] > target_ms:
+            break
+        rounds = cost
+    _calibration = {'target_ms': target_ms, 'rounds': rounds,
+                    'timings_ms': timings}
+    return calibration_report()
+
+
+def calibration_report() -> dict:
+    '''
+    Returns a copy of the last calibration report, or None when hashing
+    has not been calibrated yet.
+    '''
+    if _calibration is None:
+        return None
+    return dict(_calibration, timings_ms=dict(_calibration['timings_ms']))
+
+
+def current_rounds() -> int:
+    '''
+    Returns the bcrypt cost used by hash_password.
+
+    BCRYPT_ROUNDS from the environment wins when set; otherwise the host
+    is calibrated once, on first use.
+    '''
+    if os.getenv('BCRYPT_ROUNDS'):
+        return int(os.getenv('BCRYPT_ROUNDS'))
+    with _calibration_lock:
+        if _calibration is None:
+            calibrate()
+        return _calibration['rounds']
+
+
+def hash_rounds(hashed_password: bytes) -> int:
+    '''
+    Returns the cost a bcrypt hash was made with.
+    '''
+    return int(hashed_password.split(b'$')[2])
+
+
+def needs_rehash(hashed_password: bytes) -> bool:
+    '''
+    Checks if a hash was made with a cost other than the current one.
+    '''
+    return hash_rounds(hashed_password) != current_rounds()
 
 
 def hash_password(password: str) -> bytes:
@@ -18,20 +107,194 @@ def hash_password(password: str) -> bytes:
     A salted, hashed password as a byte string.
     '''
     pass_encoded = password.encode('utf-8')
-    pass_hashed = bcrypt.hashpw(pass_encoded, bcrypt.gensalt())
+    pass_hashed = bcrypt.hashpw(pass_encoded, bcrypt.gensalt(current_rounds()))
     return pass_hashed
 
 
-def is_valid(hashed_password: bytes, password: str) -> bool:
+def is_valid(hashed_password: bytes, password: str,
+             on_rehash: Callable[[bytes], None] = None) -> bool:
     '''
     Checks if a given password matches its hashed version.
 
     Arguments:
     hashed_password -- The hashed password (bytes).
     password -- The plaintext password (str).
+    on_rehash -- Called with hashed_password when the password matches but
+                 the hash cost differs from current_rounds(), so a rehash
+                 can be scheduled.
 
     Returns:
     True if the password matches the hashed password, False otherwise.
     '''
     pass_encoded = password.encode('utf-8')
-    return bcrypt.checkpw(pass_encoded, hashed_password)
+    valid = bcrypt.checkpw(pass_encoded, hashed_password)
+    if valid and on_rehash is not None and needs_rehash(hashed_password):
+        on_rehash(hashed_password)
+    return valid
+
+
+def hash_passwords(passwords: Iterable[str],
+                   workers: int = None) -> List[bytes]:
+    '''
+    Hashes many passwords in parallel.
+
+    bcrypt releases the GIL while hashing, so a thread pool spreads the
+    work over every core.
+
+    Arguments:
+    passwords -- The passwords to hash.
+    workers -- Number of threads (defaults to the number of CPUs).
+
+    Returns:
+    The salted, hashed passwords, in input order.
+    '''
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        return list(pool.map(hash_password, passwords))
+
+
+def are_valid(pairs: Iterable[Tuple[bytes, str]],
+              workers: int = None) -> List[bool]:
+    '''
+    Checks many passwords against their hashed versions in parallel.
+
+    Arguments:
+    pairs -- (hashed_password, password) tuples.
+    workers -- Number of threads (defaults to the number of CPUs).
+
+    Returns:
+    One boolean per pair, in input order.
+    '''
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        return list(pool.map(lambda pair: is_valid(*pair), pairs))
+
+
+class AsyncHasher:
+    '''
+    Non-blocking bcrypt for asyncio services.
+
+    Hashes run on a dedicated thread pool of max_concurrency workers; an
+    asyncio.Semaphore of the same size makes extra callers wait on the
+    event loop instead of piling up in the executor, which gives a hard
+    limit on concurrent hashes and a measurable queue.
+    '''
+
+    def __init__(self, max_concurrency: int = None):
+        '''
+        Arguments:
+        max_concurrency -- Maximum number of concurrent hashes (defaults to
+                           the number of CPUs).
+        '''
+        self.max_concurrency = max_concurrency or os.cpu_count()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix='bcrypt')
+        self._semaphore = None
+        self._loop = None
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        '''
+        Returns the semaphore bound to the running event loop.
+        '''
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def _run(self, func: Callable, *args):
+        '''
+        Runs func(*args) on the executor once a slot is free.
+        '''
+        semaphore = self._get_semaphore()
+        start = time.perf_counter()
+        self.waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        waited = time.perf_counter() - start
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        self.running += 1
+        try:
+            return await self._loop.run_in_executor(self._executor, func,
+                                                    *args)
+        finally:
+            self.running -= 1
+            self.completed += 1
+            semaphore.release()
+
+    async def hash_password(self, password: str) -> bytes:
+        '''
+        Awaitable hash_password.
+        '''
+        return await self._run(hash_password, password)
+
+    async def is_valid(self, hashed_password: bytes, password: str) -> bool:
+        '''
+        Awaitable is_valid.
+        '''
+        return await self._run(is_valid, hashed_password, password)
+
+    def metrics(self) -> dict:
+        '''
+        Returns the queue depth (callers waiting for a slot), running and
+        completed hashes, and the average and maximum wait in milliseconds.
+        '''
+        started = self.completed + self.running
+        return {'queue_depth': self.waiting,
+                'running': self.running,
+                'completed': self.completed,
+                'avg_wait_ms': self.total_wait / started * 1000
+                if started else 0.0,
+                'max_wait_ms': self.max_wait * 1000}
+
+    def shutdown(self) -> None:
+        '''
+        Stops the executor threads.
+        '''
+        self._executor.shutdown(wait=True)
+
+
+def get_async_hasher() -> AsyncHasher:
+    '''
+    Returns the shared AsyncHasher, sized by BCRYPT_MAX_CONCURRENCY from the
+    environment (defaults to the number of CPUs).
+    '''
+    global _async_hasher
+    if _async_hasher is None:
+        limit = os.getenv('BCRYPT_MAX_CONCURRENCY')
+        _async_hasher = AsyncHasher(int(limit) if limit else None)
+    return _async_hasher
+
+
+async def hash_password_async(password: str) -> bytes:
+    '''
+    Hashes a password without blocking the event loop.
+
+    Arguments:
+    password -- The password to hash.
+
+    Returns:
+    A salted, hashed password as a byte string.
+    '''
+    return await get_async_hasher().hash_password(password)
+
+
+async def is_valid_async(hashed_password: bytes, password: str) -> bool:
+    '''
+    Checks a password against its hashed version without blocking the
+    event loop.
+
+    Arguments:
+    hashed_password -- The hashed password (bytes).
+    password -- The plaintext password (str).
+
+    Returns:
+    True if the password matches the hashed password, False otherwise.
+    '''
+    return await get_async_hasher().is_valid(hashed_password, password)
@@ -6,14 +6,64 @@
     4. Read and filter data
 '''
 
+import argparse
+import atexit
+import copy
+import json
+import os
+import queue
 import re
-from typing import List
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache, partial
+from typing import (Callable, Iterator, List, Mapping, Pattern, Sequence,
+                    TextIO, Tuple)
 import logging
+from logging.handlers import QueueHandler, QueueListener
 import mysql.connector
 from os import getenv
 
 
 PII_FIELDS = ('name', 'email', 'phone', 'ssn', 'password')
+PATTERN_CACHE_SIZE = 128
+REDACTION_ENGINES = ('regex', 'tokenizer')
+STATS_LOGGER = 'redaction_stats'
+EXPORT_BATCH_SIZE = 1000
+EXPORT_BUFFER_SIZE = 1 << 20
+LOG_QUEUE_SIZE = 10000
+LOG_SAMPLE_RATE = 10
+OVERFLOW_POLICIES = ('block', 'drop', 'sample')
+SHARD_KEY = 'id'
+SHARD_MANIFEST = 'manifest.json'
+POOL_SIZE = 5
+POOL_TIMEOUT = 30.0
+RECORD_ATTRIBUTES = frozenset(
+    logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {
+        'message', 'asctime'}
+
+
+@lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def compile_redaction(fields: Tuple[str, ...], redaction: str,
+                      separator: str) -> Tuple[Pattern, str]:
+    ''' Build the single alternation regex used to obfuscate every field of
+        a log line in one scan, together with its replacement template.
+
+        Results are cached per (fields, redaction, separator) so the
+        pattern is compiled once and reused by every call.
+    '''
+    sep = re.escape(separator)
+    alternation = '|'.join(re.escape(f) for f in fields)
+    if not fields:
+        # An empty group would match every "key=value;": never match
+        alternation = '(?!)'
+    pattern = re.compile(rf'\b({alternation})\b=.*?{sep}')
+    replacement = r'\1=' + redaction.replace('\\', r'\\') + \
+        separator.replace('\\', r'\\')
+    return pattern, replacement
 
 
 def filter_datum(fields: List[str], redaction: str, message: str,
@@ -34,11 +84,81 @@ def filter_datum(fields: List[str], redaction: str, message: str,
         perform the substitution with a single regex.
     '''
 
-    for i in fields:
-        message = re.sub(rf'\b{i}\b=.*?{separator}',
-                         rf'{i}={redaction}{separator}',
-                         message)
-    return message
+    pattern, replacement = compile_redaction(tuple(fields), redaction,
+                                             separator)
+    return pattern.sub(replacement, message)
+
+
+def _utf8_size(text: str) -> int:
+    ''' Size of text encoded in UTF-8; ASCII text, whose size is its
+        length, is not encoded
+    '''
+    if text.isascii():
+        return len(text)
+    return len(text.encode('utf-8', 'surrogatepass'))
+
+
+def _is_word(char: str) -> bool:
+    ''' Whether char is a regex word character (\\w) '''
+    return char.isalnum() or char == '_'
+
+
+@lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def _token_fields(fields: frozenset) -> Tuple[Tuple[str, str, bool], ...]:
+    ''' Returns (field, field + "=", whether field starts with a word
+        character) for the fields that \\b= can follow: non-empty and
+        ending with a word character (fields do not contain "=")
+    '''
+    return tuple((f, f + '=', _is_word(f[0])) for f in sorted(fields)
+                 if f and _is_word(f[-1]))
+
+
+def filter_datum_tokens(fields: List[str], redaction: str, message: str,
+                        separator: str, redacted: List[str] = None) -> str:
+    ''' Description: regex-free counterpart of filter_datum
+
+        The occurrences of every "field=" in message are found with
+        str.find and kept when a word boundary precedes them, as
+        \\b(field)\\b= in the filter_datum pattern. Taken from left to
+        right, each one that does not lie inside a value already redacted
+        has its value, up to the next separator on the same line,
+        replaced by redaction; the message is rebuilt with a single join.
+        Nothing is split, so the work follows the PII occurrences rather
+        than the number of fields of a line. When given, redacted gets the
+        field name of every redacted value appended.
+    '''
+    if not isinstance(fields, frozenset):
+        fields = frozenset(fields)
+    found = []
+    for field, key, word_start in _token_fields(fields):
+        start = message.find(key)
+        while start >= 0:
+            before = message[start - 1] if start else ''
+            if (before.isalnum() or before == '_') != word_start:
+                found.append((start, field))
+            start = message.find(key, start + 1)
+    if not found:
+        return message
+    found.sort()
+    multiline = '\n' in message
+    parts = []
+    copied = resume = 0
+    for start, field in found:
+        if start < resume:
+            continue
+        value = start + len(field) + 1
+        end = message.find(separator, value)
+        if end < 0:
+            break
+        if multiline and message.find('\n', value, end) >= 0:
+            continue
+        parts.append(message[copied:value])
+        parts.append(redaction)
+        copied, resume = end, end + len(separator)
+        if redacted is not None:
+            redacted.append(field)
+    parts.append(message[copied:])
+    return ''.join(parts)
 
 
 class RedactingFormatter(logging.Formatter):
@@ -57,19 +177,213 @@ class RedactingFormatter(logging.Formatter):
     FORMAT = "[HOLBERTON] %(name)s %(levelname)s %(asctime)-15s: %(message)s"
     SEPARATOR = ";"
 
-    def __init__(self, fields: List[str]):
-        """ Constructor Method """
+    def __init__(self, fields: List[str], engine: str = 'regex',
+                 summary_interval: float = None,
+                 summary_logger: logging.Logger = None):
+        """ Constructor Method
+
+            engine selects how string messages are redacted: 'regex' uses
+            the filter_datum pattern, 'tokenizer' uses filter_datum_tokens.
+            With summary_interval (seconds), stats() is logged at INFO on
+            summary_logger (default: the "redaction_stats" logger) at most
+            once per interval.
+        """
+        if engine not in REDACTION_ENGINES:
+            raise ValueError(f"Unknown redaction engine: {engine}")
         super(RedactingFormatter, self).__init__(self.FORMAT)
         self.fields = fields
+        self.engine = engine
+        self.summary_interval = summary_interval
+        self.summary_logger = summary_logger or logging.getLogger(
+            STATS_LOGGER)
+        self._field_set = frozenset(fields)
+        self._extra_fields = tuple(f for f in fields
+                                   if f not in RECORD_ATTRIBUTES)
+        self._pattern = compile_redaction(
+            tuple(fields), self.REDACTION, self.SEPARATOR)[0]
+        self._replacements = {
+            f: f'{f}={self.REDACTION}{self.SEPARATOR}' for f in fields}
+        self._stats_lock = threading.Lock()
+        self._next_summary = time.monotonic() + (summary_interval or 0)
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        """ Zeroes the redaction counters """
+        with self._stats_lock:
+            self._lines = 0
+            self._bytes_in = 0
+            self._bytes_out = 0
+            self._redact_ns = 0
+            self._field_counts = Counter()
+
+    def stats(self) -> dict:
+        """ Returns the redaction counters
+
+            lines: log lines redacted
+            fields: number of redacted values per field name
+            bytes_in, bytes_out: size of the messages encoded in UTF-8,
+                                 before and after redaction
+            redact_ns: cumulative time spent redacting, in nanoseconds
+        """
+        with self._stats_lock:
+            return {'lines': self._lines,
+                    'fields': dict(self._field_counts),
+                    'bytes_in': self._bytes_in,
+                    'bytes_out': self._bytes_out,
+                    'redact_ns': self._redact_ns}
+
+    def _count(self, lines: int, size_in: int, size_out: int,
+               start_ns: int, redacted: List[str]) -> None:
+        """ Adds one redaction, and the names of the fields it redacted,
+            to the counters
+        """
+        elapsed = time.perf_counter_ns() - start_ns
+        with self._stats_lock:
+            self._lines += lines
+            self._bytes_in += size_in
+            self._bytes_out += size_out
+            self._redact_ns += elapsed
+            field_counts = self._field_counts
+            for field in redacted:
+                field_counts[field] += 1
+
+    def _replace(self, redacted: List[str], match) -> str:
+        """ Regex replacement: records and redacts one field """
+        field = match[1]
+        redacted.append(field)
+        return self._replacements[field]
+
+    def redact(self, message: str) -> str:
+        """ Obfuscates the PII fields of an already formatted message """
+        start = time.perf_counter_ns()
+        redacted = []
+        if self.engine == 'tokenizer':
+            result = filter_datum_tokens(self._field_set, self.REDACTION,
+                                         message, self.SEPARATOR, redacted)
+        else:
+            result = self._pattern.sub(partial(self._replace, redacted),
+                                       message)
+        self._count(message.count('\n') + 1, _utf8_size(message),
+                    _utf8_size(result), start, redacted)
+        return result
+
+    def redact_mapping(self, data: Mapping) -> str:
+        """ Renders a mapping as "key=value;" pairs, replacing the values
+            of PII keys without going through the regex
+        """
+        start = time.perf_counter_ns()
+        redaction, fields = self.REDACTION, self._field_set
+        redacted = [k for k in data if k in fields]
+        result = f'{self.SEPARATOR} '.join(
+            f'{k}={redaction if k in fields else v}'
+            for k, v in data.items()) + self.SEPARATOR
+        # Size of the same rendering with the values left in
+        size_out = _utf8_size(result)
+        size_in = size_out + sum(
+            _utf8_size(f'{data[k]}') - _utf8_size(redaction)
+            for k in redacted)
+        self._count(1, size_in, size_out, start, redacted)
+        return result
+
+    def log_summary(self) -> None:
+        """ Logs stats() when summary_interval has elapsed """
+        now = time.monotonic()
+        if self.summary_interval is None or now < self._next_summary:
+            return
+        self._next_summary = now + self.summary_interval
+        self.summary_logger.info("redaction stats: %s", self.stats())
 
     def format(self, record: logging.LogRecord) -> str:
-        """ Filters values in incoming log records using filter_datum """
-        return filter_datum(self.fields, self.REDACTION,
-                            super(RedactingFormatter, self).format(record),
-                            self.SEPARATOR)
-
+        """ Filters values in incoming log records using filter_datum
+
+            PII attributes passed through extra= are replaced on a copy of
+            the record. A mapping message is redacted by key and formatted
+            without a regex scan; string messages are scrubbed with the
+            compiled regex.
+        """
+        structured = isinstance(record.msg, Mapping) and not record.args
+        extras = [f for f in self._extra_fields if f in record.__dict__]
+        if structured or extras:
+            record = copy.copy(record)
+            for field in extras:
+                setattr(record, field, self.REDACTION)
+        if self.summary_interval is not None:
+            self.log_summary()
+        if not structured:
+            return self.redact(super(RedactingFormatter, self).format(record))
+        record.msg = self.redact_mapping(record.msg)
+        return super(RedactingFormatter, self).format(record)
+
+
+class OverflowQueueHandler(QueueHandler):
+    """ Queue handler feeding a bounded queue
+        Description: hands records to a QueueListener thread and applies an
+                     overflow policy when the queue is full:
+
+        block: wait until the listener makes room
+        drop: discard the record
+        sample: for one overflowing record out of sample_rate, evict the
+                oldest queued record to make room for it; discard the
+                others
+
+        dropped counts the discarded and evicted records.
+    """
 
-def get_logger() -> logging.Logger:
+    def __init__(self, log_queue: queue.Queue, overflow: str = 'block',
+                 sample_rate: int = LOG_SAMPLE_RATE):
+        """ Constructor Method """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        super(OverflowQueueHandler, self).__init__(log_queue)
+        self.overflow = overflow
+        self.sample_rate = max(1, sample_rate)
+        self.overflowed = 0
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """ Keeps mapping messages intact for RedactingFormatter """
+        if isinstance(record.msg, Mapping) and not record.args:
+            return record
+        return super(OverflowQueueHandler, self).prepare(record)
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """ Puts a record on the queue according to the overflow policy """
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            self.overflowed += 1
+        if self.overflow == 'block':
+            self.queue.put(record)
+            return
+        if self.overflow == 'sample' and \
+                (self.overflowed - 1) % self.sample_rate == 0:
+            self._evict()
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                pass
+        self.dropped += 1
+
+    def _evict(self) -> None:
+        """ Discards the oldest queued record, keeping the sentinel that
+            stops the listener
+        """
+        try:
+            oldest = self.queue.get_nowait()
+        except queue.Empty:
+            return
+        self.queue.task_done()
+        if oldest is None:
+            # QueueListener.stop() enqueues None to end its thread
+            self.queue.put_nowait(oldest)
+        else:
+            self.dropped += 1
+
+
+def get_logger(async_mode: bool = False, queue_size: int = LOG_QUEUE_SIZE,
+               overflow: str = 'block') -> logging.Logger:
     ''' Description: Implement a get_logger function that takes no arguments
                      and returns a logging.Logger object.
 
@@ -82,15 +396,32 @@ def get_logger() -> logging.Logger:
         contain only 5 fields - choose the right list of fields that can are
         considered as "important" PIIs or information that you must hide in
         your logs. Use it to parameterize the formatter.
+
+        With async_mode the logger only enqueues records on a bounded queue
+        of queue_size; redaction and stream writes run on a QueueListener
+        thread, and overflow selects what happens when the queue is full
+        (see OverflowQueueHandler). The listener is started once: later
+        async calls return the logger as the first one configured it.
     '''
     log = logging.getLogger('user_data')
     log.setLevel(logging.INFO)
     log.propagate = False
+    if async_mode and any(isinstance(h, OverflowQueueHandler)
+                          for h in log.handlers):
+        return log
 
     sh = logging.StreamHandler()
     formatter = RedactingFormatter(PII_FIELDS)
     sh.setFormatter(formatter)
-    log.addHandler(sh)
+    if not async_mode:
+        log.addHandler(sh)
+        return log
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    listener = QueueListener(log_queue, sh, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    log.addHandler(OverflowQueueHandler(log_queue, overflow))
 
     return log
 
@@ -125,17 +456,145 @@ def get_db() -> mysql.connector.connection.MySQLConnection:
              database (pip3 install mysql-connector-python)
     '''
     try:
-        connection_db = mysql.connector.connection.MySQLConnection(
-            user=getenv('PERSONAL_DATA_DB_USERNAME', 'root'),
-            password=getenv('PERSONAL_DATA_DB_PASSWORD', ''),
-            host=getenv('PERSONAL_DATA_DB_HOST', 'localhost'),
-            database=getenv('PERSONAL_DATA_DB_NAME'))
-        return connection_db
+        return connect()
     except mysql.connector.Error as err:
         logging.error(f"Error: {err}")
         return None
 
 
+def connect() -> mysql.connector.connection.MySQLConnection:
+    ''' Open a new connection from the PERSONAL_DATA_DB_* environment,
+        raising mysql.connector.Error on failure
+    '''
+    return mysql.connector.connection.MySQLConnection(
+        user=getenv('PERSONAL_DATA_DB_USERNAME', 'root'),
+        password=getenv('PERSONAL_DATA_DB_PASSWORD', ''),
+        host=getenv('PERSONAL_DATA_DB_HOST', 'localhost'),
+        database=getenv('PERSONAL_DATA_DB_NAME'))
+
+
+class ConnectionPool:
+    """ Bounded pool of reusable database connections
+        Description: at most size connections are open at once. Idle
+                     connections are health-checked with is_connected()
+                     when borrowed and replaced through factory when
+                     they are dead; borrowing waits up to timeout seconds
+                     for a free slot before raising PoolError. Returned
+                     connections are reset (unread results drained, open
+                     transaction rolled back) or closed if that fails.
+    """
+
+    def __init__(self, factory: Callable = connect, size: int = POOL_SIZE,
+                 timeout: float = POOL_TIMEOUT):
+        """ Constructor Method """
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def acquire(self) -> mysql.connector.connection.MySQLConnection:
+        """ Borrows a healthy connection from the pool """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise mysql.connector.errors.PoolError(
+                f"No connection available after {self.timeout}s")
+        try:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    return self.factory()
+                if self._is_healthy(conn):
+                    return conn
+                self._discard(conn)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn: mysql.connector.connection.MySQLConnection
+                ) -> None:
+        """ Returns a borrowed connection to the pool """
+        try:
+            if self._reset(conn):
+                self._idle.put(conn)
+            else:
+                self._discard(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self) -> Iterator[
+            mysql.connector.connection.MySQLConnection]:
+        """ Borrows a connection for the duration of a with block """
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self) -> None:
+        """ Closes every idle connection """
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+    @staticmethod
+    def _is_healthy(conn) -> bool:
+        """ Pings a connection, reporting whether it is still usable """
+        try:
+            return conn.is_connected()
+        except Exception:
+            return False
+
+    @staticmethod
+    def _reset(conn) -> bool:
+        """ Drains unread results and rolls back, as reset_session does in
+            MySQLConnectionPool, reporting whether the connection is usable
+        """
+        try:
+            if conn.unread_result:
+                conn.consume_results()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _discard(conn) -> None:
+        """ Closes a connection, ignoring errors """
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_pools = {}
+_pool_lock = threading.Lock()
+
+
+def get_pool(factory: Callable = connect) -> ConnectionPool:
+    ''' Description: return the process-wide connection pool of factory,
+                     creating it on first use.
+
+        Its size and borrow timeout (seconds) are read from
+        PERSONAL_DATA_DB_POOL_SIZE (default 5) and
+        PERSONAL_DATA_DB_POOL_TIMEOUT (default 30). factory opens new
+        connections and defaults to connect; each factory gets its own
+        pool.
+    '''
+    with _pool_lock:
+        pool = _pools.get(factory)
+        if pool is None:
+            pool = _pools[factory] = ConnectionPool(
+                factory,
+                int(getenv('PERSONAL_DATA_DB_POOL_SIZE', POOL_SIZE)),
+                float(getenv('PERSONAL_DATA_DB_POOL_TIMEOUT', POOL_TIMEOUT)))
+            atexit.register(pool.close)
+        return pool
+
+
 def main():
     '''
         Description: Implement a main function that takes no arguments and
@@ -167,8 +626,7 @@ def main():
         log = get_logger()
 
         for row in cursor:
-            str_row = ''.join(f'{f}={str(r)}; ' for r, f in zip(row, fields))
-            log.info(str_row.strip())
+            log.info(format_row(row, fields))
 
         cursor.close()
         database.close()
@@ -176,5 +634,174 @@ def main():
         logging.error(f"Error: {e}")
 
 
+def format_row(row: Sequence, fields: List[str]) -> str:
+    ''' Render a users row as the "key=value;" line logged by main '''
+    return '; '.join(f'{f}={r}' for f, r in zip(fields, row)) + ';'
+
+
+def export_users(database: mysql.connector.connection.MySQLConnection,
+                 sink: TextIO, batch_size: int = EXPORT_BATCH_SIZE,
+                 query: str = "SELECT * FROM users;",
+                 params: tuple = ()) -> int:
+    ''' Description: stream the users table to sink under a filtered format
+
+        Rows are read from an unbuffered cursor with fetchmany so only one
+        batch is held in memory at a time. Each batch is rendered as a
+        block of lines, redacted with a single regex scan and written to
+        sink followed by one flush. query and params select the rows to
+        export. When reading or writing fails with rows left unread,
+        database is closed: skipping them would mean reading them all.
+
+        Returns the number of exported rows.
+    '''
+    formatter = RedactingFormatter(PII_FIELDS)
+    cursor = database.cursor(buffered=False)
+    count = 0
+    try:
+        cursor.execute(query, params)
+        fields = [i[0] for i in cursor.description]
+        rows = cursor.fetchmany(batch_size)
+        while rows:
+            block = '\n'.join(format_row(row, fields) for row in rows)
+            sink.write(formatter.redact(block) + '\n')
+            sink.flush()
+            count += len(rows)
+            rows = cursor.fetchmany(batch_size)
+    except BaseException:
+        # Closing an unbuffered cursor with unread rows raises
+        # InternalError, which would hide the error being handled
+        if database.unread_result:
+            database.close()
+        else:
+            cursor.close()
+        raise
+    cursor.close()
+    return count
+
+
+def export_main(path: str, batch_size: int = EXPORT_BATCH_SIZE) -> None:
+    ''' Export the filtered users table to path ("-" for stdout) '''
+    if not validate_env_vars():
+        return
+
+    database = get_db()
+    if database is None:
+        return
+
+    try:
+        if path == '-':
+            export_users(database, sys.stdout, batch_size)
+        else:
+            with open(path, 'w', buffering=EXPORT_BUFFER_SIZE) as sink:
+                export_users(database, sink, batch_size)
+    except Exception as e:
+        logging.error(f"Error: {e}")
+    finally:
+        database.close()
+
+
+def shard_ranges(low: int, high: int, shards: int) -> List[Tuple[int, int]]:
+    ''' Split the inclusive key range [low, high] into at most shards
+        contiguous inclusive ranges
+    '''
+    if low is None or high is None:
+        return []
+    step = max(1, -(-(high - low + 1) // max(1, shards)))
+    return [(start, min(start + step - 1, high))
+            for start in range(low, high + 1, step)]
+
+
+def export_shard(job: Tuple[str, str, int, int, int]) -> int:
+    ''' Worker: export the users whose key lies in [low, high] to path
+
+        Runs in a pool process with its own database connection.
+        Returns the number of exported rows.
+    '''
+    path, key, low, high, batch_size = job
+    database = get_db()
+    if database is None:
+        raise RuntimeError("Cannot connect to the database")
+    try:
+        with open(path, 'w', buffering=EXPORT_BUFFER_SIZE) as sink:
+            return export_users(
+                database, sink, batch_size,
+                f"SELECT * FROM users WHERE {key} BETWEEN %s AND %s;",
+                (low, high))
+    finally:
+        database.close()
+
+
+def export_sharded(out_dir: str, shards: int, workers: int = None,
+                   key: str = SHARD_KEY,
+                   batch_size: int = EXPORT_BATCH_SIZE) -> dict:
+    ''' Description: export the users table as redacted shards in parallel
+
+        The table is split into ranges of its integer primary key, each
+        range is exported by a pool process to its own shard file in
+        out_dir, and a manifest with the row count of every shard is
+        written next to them.
+
+        Returns the manifest.
+    '''
+    if not re.fullmatch(r'\w+', key):
+        raise ValueError(f"Invalid shard key: {key}")
+
+    database = get_db()
+    if database is None:
+        raise RuntimeError("Cannot connect to the database")
+    try:
+        cursor = database.cursor()
+        cursor.execute(f"SELECT MIN({key}), MAX({key}) FROM users;")
+        low, high = cursor.fetchone()
+        cursor.close()
+    finally:
+        database.close()
+
+    os.makedirs(out_dir, exist_ok=True)
+    ranges = shard_ranges(low, high, shards)
+    jobs = [(os.path.join(out_dir, f'users.{i:04d}.log'), key, lo, hi,
+             batch_size) for i, (lo, hi) in enumerate(ranges)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        counts = list(pool.map(export_shard, jobs))
+
+    manifest = {
+        'key': key,
+        'rows': sum(counts),
+        'shards': [{'path': os.path.basename(job[0]), 'low': job[2],
+                    'high': job[3], 'rows': count}
+                   for job, count in zip(jobs, counts)]
+    }
+    with open(os.path.join(out_dir, SHARD_MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    ''' Parse the command line of the filtered_logger script '''
+    parser = argparse.ArgumentParser(
+        description='Display the users table under a filtered format')
+    parser.add_argument('--export', metavar='PATH',
+                        help='stream redacted rows to PATH ("-" for stdout)')
+    parser.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE,
+                        help='rows fetched and written per batch')
+    parser.add_argument('--out-dir', metavar='DIR',
+                        help='export redacted shards and a manifest to DIR')
+    parser.add_argument('--shards', type=int, default=os.cpu_count(),
+                        help='number of primary-key ranges to export')
+    parser.add_argument('--workers', type=int,
+                        help='worker processes (default: one per core)')
+    parser.add_argument('--shard-key', default=SHARD_KEY,
+                        help='integer primary key used to split the table')
+    return parser.parse_args(argv)
+
+
 if __name__ == '__main__':
-    main()
+    args = parse_args()
+    if args.out_dir is not None:
+        if validate_env_vars():
+            export_sharded(args.out_dir, args.shards, args.workers,
+                           args.shard_key, args.batch_size)
+    elif args.export is not None:
+        export_main(args.export, args.batch_size)
+    else:
+        main()
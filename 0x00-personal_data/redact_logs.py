@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+''' Offline redaction of existing "key=value;" log files
+
+    Usage: ./redact_logs.py [-o OUTPUT] [--chunk-size MB] FILE [FILE ...]
+
+    Each input is memory-mapped and scrubbed in large line-aligned chunks
+    with a bytes version of the filter_datum regex. Without -o the file is
+    rewritten in place through a temporary file and an atomic rename.
+'''
+
+import argparse
+import mmap
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from typing import BinaryIO, Callable, List, Pattern, Tuple
+from filtered_logger import PII_FIELDS, RedactingFormatter, compile_redaction
+
+
+CHUNK_SIZE = 64 << 20
+WRITE_BUFFER_SIZE = 8 << 20
+
+
+def compile_bytes_redaction(fields: Tuple[str, ...], redaction: str,
+                            separator: str) -> Tuple[Pattern, Callable]:
+    ''' Return the filter_datum pattern as bytes and its replacement
+
+        The replacement looks the matched field up in a table of prebuilt
+        "field=redaction<separator>" strings, which is cheaper than having
+        re expand a group template on every match.
+    '''
+    pattern = compile_redaction(tuple(fields), redaction, separator)[0]
+    table = {f.encode('utf-8'): f'{f}={redaction}{separator}'.encode('utf-8')
+             for f in fields}
+    return (re.compile(pattern.pattern.encode('utf-8')),
+            lambda match: table[match[1]])
+
+
+def redact_buffer(data: bytes, sink: BinaryIO, pattern: Pattern,
+                  replacement: Callable,
+                  chunk_size: int = CHUNK_SIZE) -> None:
+    ''' Write data to sink with PII fields obfuscated
+
+        data is processed in chunks of about chunk_size bytes, each cut at
+        a line boundary so no field is split between two chunks.
+    '''
+    start, size = 0, len(data)
+    while start < size:
+        end = min(start + chunk_size, size)
+        if end < size:
+            newline = data.rfind(b'\n', start, end)
+            if newline < 0:
+                newline = data.find(b'\n', end)
+            end = size if newline < 0 else newline + 1
+        sink.write(pattern.sub(replacement, data[start:end]))
+        start = end
+
+
+def redact_file(src: str, dst: str = None, fields: List[str] = PII_FIELDS,
+                chunk_size: int = CHUNK_SIZE) -> int:
+    ''' Redact the log file src into dst, or in place when dst is None
+
+        Returns the number of bytes read. Raises ValueError when dst is
+        src itself (or a link to it), which opening for writing would
+        truncate before it is read.
+    '''
+    if dst is not None and os.path.exists(dst) and \
+            os.path.samefile(src, dst):
+        raise ValueError(f'{dst} is the input file {src}; '
+                         'omit --output to redact it in place')
+    pattern, replacement = compile_bytes_redaction(
+        tuple(fields), RedactingFormatter.REDACTION,
+        RedactingFormatter.SEPARATOR)
+    target = dst
+    if dst is None:
+        fd, target = tempfile.mkstemp(dir=os.path.dirname(src) or '.',
+                                      prefix='.redact-')
+        os.close(fd)
+    try:
+        with open(src, 'rb') as f_in, \
+                open(target, 'wb', buffering=WRITE_BUFFER_SIZE) as f_out:
+            size = os.fstat(f_in.fileno()).st_size
+            if size > 0:
+                with mmap.mmap(f_in.fileno(), 0,
+                               access=mmap.ACCESS_READ) as data:
+                    redact_buffer(data, f_out, pattern, replacement,
+                                  chunk_size)
+        if dst is None:
+            shutil.copymode(src, target)
+            os.replace(target, src)
+    except BaseException:
+        if dst is None and os.path.exists(target):
+            os.remove(target)
+        raise
+    return size
+
+
+def main(argv: List[str] = None) -> None:
+    ''' Redact every file given on the command line and report throughput '''
+    parser = argparse.ArgumentParser(
+        description='Redact PII fields in existing log files')
+    parser.add_argument('files', nargs='+', metavar='FILE')
+    parser.add_argument('-o', '--output',
+                        help='write to OUTPUT instead of editing in place '
+                             '(single input only)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE >> 20,
+                        metavar='MB', help='size of the scanned chunks')
+    args = parser.parse_args(argv)
+    if args.output is not None and len(args.files) != 1:
+        parser.error('--output requires a single input file')
+
+    for path in args.files:
+        start = time.perf_counter()
+        try:
+            size = redact_file(path, args.output, PII_FIELDS,
+                               max(1, args.chunk_size) << 20)
+        except ValueError as exc:
+            parser.error(str(exc))
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        mb = size / (1 << 20)
+        print(f'{path}: {mb:.1f} MB in {elapsed:.2f}s '
+              f'({mb / elapsed:.1f} MB/s)', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+''' Unit tests of ConnectionPool and get_pool with a fake connection
+    factory
+
+    Usage: python3 -m unittest test_connection_pool
+'''
+
+import threading
+import unittest
+import mysql.connector
+from filtered_logger import ConnectionPool, get_pool
+
+
+class FakeConnection:
+    """ Stand-in for a MySQLConnection recording what the pool does """
+
+    def __init__(self):
+        """ Constructor Method """
+        self.connected = True
+        self.unread_result = False
+        self.rollbacks = 0
+        self.closed = False
+
+    def is_connected(self) -> bool:
+        """ Reports whether the connection is alive """
+        return self.connected
+
+    def consume_results(self) -> None:
+        """ Drains the pending result set """
+        self.unread_result = False
+
+    def rollback(self) -> None:
+        """ Ends the open transaction, failing on unread results """
+        if self.unread_result:
+            raise mysql.connector.Error("Unread result found")
+        if not self.connected:
+            raise mysql.connector.Error("Lost connection")
+        self.rollbacks += 1
+
+    def close(self) -> None:
+        """ Closes the connection """
+        self.closed = True
+        self.connected = False
+
+
+class FakeFactory:
+    """ Connection factory keeping every connection it opened """
+
+    def __init__(self):
+        """ Constructor Method """
+        self.opened = []
+
+    def __call__(self) -> FakeConnection:
+        """ Opens a new connection """
+        conn = FakeConnection()
+        self.opened.append(conn)
+        return conn
+
+
+class TestConnectionPool(unittest.TestCase):
+    """ Tests of ConnectionPool """
+
+    def setUp(self):
+        """ Creates a pool of two connections """
+        self.factory = FakeFactory()
+        self.pool = ConnectionPool(self.factory, size=2, timeout=0.1)
+
+    def test_borrow_and_return(self):
+        """ A returned connection is reset and borrowed again """
+        with self.pool.connection() as conn:
+            self.assertIs(conn, self.factory.opened[0])
+        self.assertEqual(conn.rollbacks, 1)
+        with self.pool.connection() as again:
+            self.assertIs(again, conn)
+        self.assertEqual(len(self.factory.opened), 1)
+
+    def test_size_bound(self):
+        """ At most size connections are borrowed at once """
+        first = self.pool.acquire()
+        second = self.pool.acquire()
+        self.assertIsNot(first, second)
+        with self.assertRaises(mysql.connector.errors.PoolError):
+            self.pool.acquire()
+        self.pool.release(first)
+        self.assertIs(self.pool.acquire(), first)
+
+    def test_timeout_waits_for_release(self):
+        """ A borrower waiting for a slot gets the released connection """
+        pool = ConnectionPool(self.factory, size=1, timeout=5)
+        conn = pool.acquire()
+        timer = threading.Timer(0.05, pool.release, (conn,))
+        timer.start()
+        self.assertIs(pool.acquire(), conn)
+        timer.join()
+
+    def test_dead_connection_replaced(self):
+        """ A connection found dead when borrowed is closed and replaced """
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+        conn.connected = False
+        fresh = self.pool.acquire()
+        self.assertIsNot(fresh, conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(len(self.factory.opened), 2)
+
+    def test_unread_result_drained(self):
+        """ Unread results are drained before the rollback on release """
+        conn = self.pool.acquire()
+        conn.unread_result = True
+        self.pool.release(conn)
+        self.assertFalse(conn.unread_result)
+        self.assertEqual(conn.rollbacks, 1)
+        self.assertIs(self.pool.acquire(), conn)
+
+    def test_failed_reset_discards(self):
+        """ A connection that cannot be reset is closed, not pooled """
+        conn = self.pool.acquire()
+        conn.connected = False
+        self.pool.release(conn)
+        self.assertTrue(conn.closed)
+        self.assertIsNot(self.pool.acquire(), conn)
+        self.assertIsNotNone(self.pool.acquire())
+
+    def test_close(self):
+        """ close() closes the idle connections """
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+        self.pool.close()
+        self.assertTrue(conn.closed)
+
+
+class TestGetPool(unittest.TestCase):
+    """ Tests of get_pool """
+
+    def test_pool_per_factory(self):
+        """ Each factory gets its own process-wide pool """
+        first, second = FakeFactory(), FakeFactory()
+        pool = get_pool(first)
+        self.assertIs(get_pool(first), pool)
+        self.assertIs(pool.factory, first)
+        self.assertIsNot(get_pool(second), pool)
+        self.assertIs(get_pool(second).factory, second)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+''' Unit tests of the overflow policies of OverflowQueueHandler
+
+    Usage: python3 -m unittest test_overflow_queue_handler
+'''
+
+import logging
+import queue
+import unittest
+from filtered_logger import OverflowQueueHandler
+
+
+def overflow(policy: str, count: int = 20, size: int = 4,
+             sample_rate: int = 2) -> OverflowQueueHandler:
+    """ Logs count records through a handler whose queue of size records
+        is never drained, returning the handler
+    """
+    handler = OverflowQueueHandler(queue.Queue(maxsize=size), policy,
+                                   sample_rate)
+    log = logging.Logger(f'test_overflow_{policy}')
+    log.addHandler(handler)
+    for i in range(count):
+        log.warning('record %d', i)
+    return handler
+
+
+def queued(handler: OverflowQueueHandler) -> list:
+    """ Messages left in the queue of handler, oldest first """
+    return [record.getMessage() for record in handler.queue.queue]
+
+
+class TestOverflowQueueHandler(unittest.TestCase):
+    """ Tests of the drop and sample policies """
+
+    def test_drop_keeps_oldest(self):
+        """ drop discards every overflowing record """
+        handler = overflow('drop')
+        self.assertEqual(queued(handler), [f'record {i}' for i in range(4)])
+        self.assertEqual(handler.overflowed, 16)
+        self.assertEqual(handler.dropped, 16)
+
+    def test_sample_keeps_one_out_of_rate(self):
+        """ sample queues one overflowing record out of sample_rate in
+            place of the oldest queued one
+        """
+        handler = overflow('sample')
+        self.assertEqual(queued(handler),
+                         [f'record {i}' for i in (12, 14, 16, 18)])
+        self.assertEqual(handler.overflowed, 16)
+        self.assertEqual(handler.dropped, 16)
+
+    def test_sample_differs_from_drop(self):
+        """ Recent records reach the listener under sample, not drop """
+        self.assertIn('record 18', queued(overflow('sample')))
+        self.assertNotIn('record 18', queued(overflow('drop')))
+
+    def test_sample_keeps_sentinel(self):
+        """ Eviction never discards the sentinel stopping the listener """
+        handler = OverflowQueueHandler(queue.Queue(maxsize=1), 'sample', 1)
+        handler.queue.put_nowait(None)
+        handler.enqueue(logging.makeLogRecord({'msg': 'late'}))
+        self.assertEqual(list(handler.queue.queue), [None])
+        self.assertEqual(handler.dropped, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
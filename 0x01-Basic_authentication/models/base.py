@@ -1,21 +1,162 @@
 #!/usr/bin/env python3
 """ Base module
 """
+from bisect import bisect_left, bisect_right, insort
 from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from typing import (BinaryIO, TypeVar, List, Iterable, Iterator, Optional,
+                    Tuple, Union)
+from os import getenv, path
+import atexit
+import fcntl
 import json
+import logging
+import os
+import stat
+import threading
+import time
 import uuid
+from models import codec
+from models.jsonl_storage import JsonLinesStorage
+from models.rwlock import RWLock
+from models.sqlite_storage import SqliteStorage
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
 DATA = {}
+INDEX = {}
+ORDER = {}
+STAMPS = {}
+LOCKS = {}
+JOURNAL_RATIO = 1.0
+JOURNAL_MIN_SIZE = 1 << 16
+FLUSH_INTERVAL = 1.0
+FLUSH_CHANGES = 1000
+QUERY_CHUNK_SIZE = 1000
+_compacting = set()
+_dirty = {}
+_dirty_lock = threading.Lock()
+_flush_event = threading.Event()
+_flusher = None
+ENGINES = {'jsonl': JsonLinesStorage, 'sqlite': SqliteStorage}
+STORAGES = {}
+_storages_lock = threading.Lock()
+_snapshot_locks = {}
+SEQUENCES = {}
+_sequence_lock = threading.Lock()
+# Hash index key of values that cannot be hashed; equality searches on
+# such values cannot use the index and scan instead
+UNHASHABLE = object()
+
+
+def storage_mode() -> str:
+    """ Persistence mode from BASE_STORAGE:
+    - json: every save()/remove() rewrites the class snapshot (default)
+    - journal: every save()/remove() appends one record to the class
+      journal, which is compacted into the snapshot in the background
+    - deferred: save()/remove() only mark the class dirty; a background
+      thread rewrites the snapshot every BASE_FLUSH_INTERVAL seconds
+      (default 1) or after BASE_FLUSH_CHANGES changes (default 1000)
+    - jsonl: objects are not kept in DATA but read on demand from a
+      JsonLinesStorage engine, which several processes can share (it
+      serializes writes with a flock on .db_<Class>.jsonl.lock)
+    - sqlite: likewise, from a SqliteStorage engine (one table per class
+      in BASE_SQLITE_PATH), which several processes can share
+
+    In the json, journal and deferred modes, processes sharing the files
+    write snapshots one at a time, holding a flock on .db_<Class>.lock,
+    which is created next to the snapshot and left in place.
+    """
+    return getenv('BASE_STORAGE', 'json')
+
+
+def parse_timestamp(value: str) -> datetime:
+    """ Parse a TIMESTAMP_FORMAT string, through the much faster ISO
+    parser when possible
+    """
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+def file_stamp(st: os.stat_result) -> tuple:
+    """ Identity of a file version: snapshots are replaced, never edited,
+    so a new inode, size or mtime means new content
+    """
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def create_temp(file_path: str) -> Tuple[int, str]:
+    """ Create a uniquely named file next to file_path, to be renamed over
+    it, and return its descriptor and path; it gets the permissions of
+    file_path or, when there is none yet, those open() gives a new file
+    (0666 less the umask, where mkstemp always uses 0600)
+    """
+    try:
+        mode = stat.S_IMODE(os.stat(file_path).st_mode)
+    except FileNotFoundError:
+        mode = None
+    tmp_path = "{}.{}".format(file_path, uuid.uuid4().hex)
+    fd = os.open(tmp_path,
+                 os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_CLOEXEC, 0o666)
+    if mode is not None:
+        try:
+            os.fchmod(fd, mode)
+        except BaseException:
+            os.close(fd)
+            os.remove(tmp_path)
+            raise
+    return fd, tmp_path
+
+
+def hash_value(value):
+    """ Key of a value in a hash index
+    """
+    try:
+        hash(value)
+    except TypeError:
+        return UNHASHABLE
+    return value
+
+
+def order_value(value: Union[datetime, int, str, None]) -> str:
+    """ Sort key of a value in an ordered index: TIMESTAMP_FORMAT strings
+    sort chronologically, so datetimes are formatted (to the second), and
+    integers are zero-padded to sort numerically
+    """
+    if type(value) is datetime:
+        return value.strftime(TIMESTAMP_FORMAT)
+    if type(value) is int:
+        return '{:020d}'.format(value)
+    return '' if value is None else str(value)
+
+
+def class_lock(s_class: str) -> RWLock:
+    """ Readers-writer lock of the objects of a class: get(), search(),
+    query() and snapshots share the read side (class_lock(s).reading()),
+    while changes to DATA and the indexes hold the write side
+    """
+    lock = LOCKS.get(s_class)
+    if lock is None:
+        lock = LOCKS.setdefault(s_class, RWLock())
+    return lock
 
 
 class Base():
     """ Base class
+
+    Attributes are declared in __slots__ so instances carry no __dict__;
+    subclasses list their own attributes in __slots__ as well.
     """
 
+    __slots__ = ('id', 'created_at', 'updated_at', '_seq')
+
+    # Attributes with a hash index used by search() for equality lookups
+    INDEXES = ()
+    # Attributes with a sorted index used by query() for range lookups;
+    # _seq orders objects by their first save (see _sequence())
+    ORDERED_INDEXES = ('created_at', 'updated_at', '_seq')
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
@@ -25,15 +166,14 @@ class Base():
 
         self.id = kwargs.get('id', str(uuid.uuid4()))
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = parse_timestamp(kwargs.get('created_at'))
         else:
             self.created_at = datetime.utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = parse_timestamp(kwargs.get('updated_at'))
         else:
             self.updated_at = datetime.utcnow()
+        self._seq = kwargs.get('_seq')
 
     def __eq__(self, other: TypeVar('Base')) -> bool:
         """ Equality
@@ -44,11 +184,31 @@ class Base():
             return False
         return (self.id == other.id)
 
+    @classmethod
+    def _fields(cls) -> tuple:
+        """ Attribute names of the class, from Base down to cls
+        """
+        fields = cls.__dict__.get('_field_names')
+        if fields is None:
+            fields = []
+            for klass in reversed(cls.__mro__):
+                for key in klass.__dict__.get('__slots__', ()):
+                    if key not in fields and key != '__dict__':
+                        fields.append(key)
+            fields = tuple(fields)
+            setattr(cls, '_field_names', fields)
+        return fields
+
     def to_json(self, for_serialization: bool = False) -> dict:
         """ Convert the object a JSON dictionary
         """
         result = {}
-        for key, value in self.__dict__.items():
+        items = [(key, getattr(self, key, self)) for key in self._fields()]
+        items.extend(getattr(self, '__dict__', {}).items())
+        for key, value in items:
+            if value is self:
+                # Slot never assigned
+                continue
             if not for_serialization and key[0] == '_':
                 continue
             if type(value) is datetime:
@@ -57,55 +217,611 @@ class Base():
                 result[key] = value
         return result
 
+    @classmethod
+    def _engine(cls):
+        """ Storage engine of the class, or None when its objects are held
+        in DATA
+        """
+        mode = storage_mode()
+        if mode not in ENGINES:
+            return None
+        key = (cls.__name__, mode)
+        engine = STORAGES.get(key)
+        if engine is None:
+            with _storages_lock:
+                engine = STORAGES.get(key)
+                if engine is None:
+                    engine = ENGINES[mode](cls.__name__, cls.INDEXES)
+                    STORAGES[key] = engine
+        return engine
+
+    @classmethod
+    def _sequence(cls, objs: List[TypeVar('Base')]) -> list:
+        """ Give the objects never saved an insertion sequence value, above
+        every value given or loaded so far, and return them
+
+        Values follow time.time_ns() so that objects saved by different
+        processes still interleave by save time. Called with the write
+        lock held, so values increase in the order objects enter DATA;
+        storage engines have no such lock, and two threads saving at once
+        may store their objects in the opposite order.
+        """
+        s_class = cls.__name__
+        fresh = [obj for obj in objs if obj._seq is None]
+        if not fresh:
+            return fresh
+        with _sequence_lock:
+            last = SEQUENCES.get(s_class, 0)
+            keys = ORDER.get(s_class, {}).get('_seq')
+            if keys and keys[-1][0]:
+                last = max(last, int(keys[-1][0]))
+            seq = max(last + 1, time.time_ns())
+            for obj in fresh:
+                obj._seq = seq
+                seq += 1
+            SEQUENCES[s_class] = seq - 1
+        return fresh
+
+    def order_key(self, attribute: str = 'created_at') -> Tuple[str, str]:
+        """ Position of the object in the ordered index of attribute:
+        the value as given by order_value(), then the ID
+        """
+        return (order_value(getattr(self, attribute, None)), self.id)
+
+    @classmethod
+    def _index_values(cls, obj) -> tuple:
+        """ Values of an object, or of its raw dictionary, for the hash
+        indexes followed by the ordered indexes
+        """
+        if type(obj) is dict:
+            get = obj.get
+        else:
+            def get(k):
+                return getattr(obj, k, None)
+        return (tuple(hash_value(get(k)) for k in cls.INDEXES) +
+                tuple(order_value(get(k)) for k in cls.ORDERED_INDEXES))
+
+    @classmethod
+    def _index(cls, obj_id: str, values: tuple):
+        """ Add an object to the hash and ordered indexes of its class,
+        given its _index_values()
+        """
+        if not cls.INDEXES and not cls.ORDERED_INDEXES:
+            return
+        s_class = cls.__name__
+        indexes = INDEX.setdefault(s_class, {'ids': {}})
+        indexes['ids'][obj_id] = values
+        for k, v in zip(cls.INDEXES, values):
+            indexes.setdefault(k, {}).setdefault(v, {})[obj_id] = None
+        order = ORDER.setdefault(s_class, {})
+        for k, v in zip(cls.ORDERED_INDEXES, values[len(cls.INDEXES):]):
+            insort(order.setdefault(k, []), (v, obj_id))
+
+    @classmethod
+    def _index_all(cls):
+        """ Build the indexes of a freshly loaded class, in one pass over
+        its raw dictionaries; ordered indexes are sorted once at the end
+        """
+        if not cls.INDEXES and not cls.ORDERED_INDEXES:
+            return
+        attrs = cls.INDEXES
+        indexes = {'ids': {}}
+        for k in attrs:
+            indexes[k] = {}
+        order = {k: [] for k in cls.ORDERED_INDEXES}
+        ordered = [(k, order[k].append, len(attrs) + i)
+                   for i, k in enumerate(cls.ORDERED_INDEXES)]
+        ids = indexes['ids']
+        for obj_id, obj_json in DATA[cls.__name__].items():
+            values = cls._index_values(obj_json)
+            ids[obj_id] = values
+            for k, v in zip(attrs, values):
+                lookup = indexes[k].get(v)
+                if lookup is None:
+                    indexes[k][v] = {obj_id: None}
+                else:
+                    lookup[obj_id] = None
+            for k, append, i in ordered:
+                append((values[i], obj_id))
+        for keys in order.values():
+            keys.sort()
+        INDEX[cls.__name__] = indexes
+        ORDER[cls.__name__] = order
+
+    @classmethod
+    def _unindex(cls, obj_id: str):
+        """ Remove an object ID from the indexes of its class
+        """
+        indexes = INDEX.get(cls.__name__)
+        if indexes is None:
+            return
+        values = indexes['ids'].pop(obj_id, None)
+        if values is None:
+            return
+        for k, v in zip(cls.INDEXES, values):
+            ids = indexes[k][v]
+            del ids[obj_id]
+            if not ids:
+                del indexes[k][v]
+        order = ORDER.get(cls.__name__, {})
+        for k, v in zip(cls.ORDERED_INDEXES, values[len(cls.INDEXES):]):
+            keys = order.get(k, [])
+            i = bisect_left(keys, (v, obj_id))
+            if i < len(keys) and keys[i] == (v, obj_id):
+                del keys[i]
+
+    @classmethod
+    def _put(cls, obj_id: str, obj):
+        """ Store an object, or its raw dictionary, in DATA and the indexes
+        """
+        # Computed first so a failure leaves DATA and the indexes as is
+        values = cls._index_values(obj)
+        DATA[cls.__name__][obj_id] = obj
+        cls._unindex(obj_id)
+        cls._index(obj_id, values)
+
+    @classmethod
+    def _hydrate(cls, obj_id: str) -> TypeVar('Base'):
+        """ Return the object stored under obj_id, building it from its
+        raw dictionary on first access (readers racing on the same raw
+        dictionary may each build an object; the last one is kept)
+        """
+        objs = DATA[cls.__name__]
+        obj = objs.get(obj_id)
+        if type(obj) is dict:
+            obj = cls(**obj)
+            objs[obj_id] = obj
+        return obj
+
+    @classmethod
+    def _delete(cls, obj_id: str) -> bool:
+        """ Drop an object from DATA and the indexes
+        """
+        if DATA[cls.__name__].pop(obj_id, None) is None:
+            return False
+        cls._unindex(obj_id)
+        return True
+
     @classmethod
     def load_from_file(cls):
-        """ Load all objects from file
+        """ Load all objects from file, then replay the journal
+
+        Objects are kept as raw dictionaries and only built when get() or
+        search() first returns them. Nothing is read when the snapshot
+        and the journal are those already loaded, and only the appended
+        records are replayed when just the journal grew, so calling this
+        before every lookup costs a couple of stat() calls.
+        """
+        s_class = cls.__name__
+        # Unflushed changes would be lost by the reload
+        cls.flush()
+        engine = cls._engine()
+        if engine is not None:
+            DATA[s_class] = {}
+            engine.reload()
+            return
+        with class_lock(s_class).reading():
+            if cls._refresh(replay=False):
+                return
+        with class_lock(s_class):
+            cls._reload()
+
+    @classmethod
+    def _reload(cls):
+        """ Bring DATA up to date with the files, with the write lock held:
+        replay new journal records when possible, else reload everything
         """
         s_class = cls.__name__
         file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
+        journal_path = ".db_{}.journal".format(s_class)
+        if cls._refresh():
             return
+        DATA[s_class] = {}
+        INDEX[s_class] = {'ids': {}}
+        ORDER[s_class] = {}
+        snapshot = journal = None
+        if path.exists(file_path):
+            with open(file_path, 'rb') as f:
+                snapshot = file_stamp(os.fstat(f.fileno()))
+                DATA[s_class] = codec.loads(f.read())
+            cls._index_all()
+        if path.exists(journal_path):
+            with open(journal_path, 'rb') as f:
+                journal = (os.fstat(f.fileno()).st_ino, cls._replay(f))
+        STAMPS[s_class] = {'snapshot': snapshot, 'journal': journal}
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+    @classmethod
+    def _refresh(cls, replay: bool = True) -> bool:
+        """ Bring DATA up to date without a full reload when possible:
+        return True if the snapshot is the loaded one and the journal is
+        unchanged or, when replay is set, only appended to (the new
+        records are then replayed)
+
+        STAMPS records the file_stamp() of the loaded snapshot and the
+        (inode, offset) of the journal up to the last applied record.
+        """
+        s_class = cls.__name__
+        stamps = STAMPS.get(s_class)
+        if stamps is None:
+            return False
+        try:
+            snapshot = file_stamp(os.stat(".db_{}.json".format(s_class)))
+        except FileNotFoundError:
+            snapshot = None
+        if snapshot != stamps['snapshot']:
+            return False
+        known = stamps['journal']
+        journal_path = ".db_{}.journal".format(s_class)
+        try:
+            st = os.stat(journal_path)
+        except FileNotFoundError:
+            return known is None
+        if known is None or st.st_ino != known[0] or st.st_size < known[1]:
+            return False
+        if st.st_size == known[1]:
+            return True
+        if not replay:
+            return False
+        with open(journal_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_ino != known[0]:
+                return False
+            f.seek(known[1])
+            stamps['journal'] = (known[0], cls._replay(f))
+        return True
+
+    @classmethod
+    def _replay(cls, f: BinaryIO) -> int:
+        """ Apply the journal records read from f on top of the loaded
+        objects, returning the offset following the last complete one
+        """
+        offset = f.tell()
+        for line in f:
+            if not line.endswith(b'\n'):
+                # Record being appended, or torn by a crash
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if record['op'] == 'put':
+                cls._put(record['id'], record['obj'])
+            elif record['op'] == 'del':
+                cls._delete(record['id'])
+            offset += len(line)
+        return offset
 
     @classmethod
     def save_to_file(cls):
         """ Save all objects to file
+
+        The snapshot is encoded with the BASE_CODEC codec and written to a
+        temporary file renamed over the previous one, so a crash never
+        leaves a half-written file, with the permissions of the previous
+        one. The part of the journal reflected in DATA is folded into the
+        snapshot and discarded.
         """
         s_class = cls.__name__
         file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        engine = cls._engine()
+        if engine is not None:
+            engine.flush()
+            return
+        # Snapshots of a class are written one at a time, by threads and
+        # by processes, so each one copies DATA after the previous one was
+        # renamed and the newest snapshot always wins
+        with _snapshot_locks.setdefault(s_class, threading.Lock()), \
+                open(".db_{}.lock".format(s_class), 'a') as lock_f:
+            fcntl.flock(lock_f.fileno(), fcntl.LOCK_EX)
+            # Only the copy holds the lock: writers carry on while the
+            # snapshot is encoded and written
+            with class_lock(s_class):
+                if storage_mode() == 'journal':
+                    # Every local change is in the journal, so records
+                    # appended by other processes can be applied first
+                    cls._reload()
+                objs = list(DATA[s_class].items())
+                applied = STAMPS.get(s_class, {}).get('journal')
+            objs_json = {}
+            for obj_id, obj in objs:
+                if type(obj) is dict:
+                    objs_json[obj_id] = obj
+                else:
+                    objs_json[obj_id] = obj.to_json(True)
+
+            fd, tmp_path = create_temp(file_path)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(codec.dumps(objs_json))
+                    f.flush()
+                    snapshot = file_stamp(os.fstat(f.fileno()))
+                os.replace(tmp_path, file_path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            with class_lock(s_class):
+                # The objects in memory include everything just written
+                stamps = STAMPS.setdefault(
+                    s_class, {'snapshot': None, 'journal': None})
+                stamps['snapshot'] = snapshot
+                if applied is not None:
+                    cls._trim_journal(*applied)
+
+    @classmethod
+    def _trim_journal(cls, ino: int, size: int):
+        """ Drop the first size bytes of the journal, applied to DATA
+        before the snapshot was copied; records appended since then, by
+        this process or another, are kept. Nothing is dropped when the
+        journal is no longer the file of inode ino.
+        """
+        journal_path = ".db_{}.journal".format(cls.__name__)
+        stamps = STAMPS[cls.__name__]
+        f = cls._open_journal('rb')
+        if f is None:
+            return
+        # The lock keeps other processes from appending to the old file
+        # until it is replaced
+        with f:
+            st = os.fstat(f.fileno())
+            if st.st_ino != ino:
+                return
+            if st.st_size <= size:
+                os.remove(journal_path)
+                stamps['journal'] = None
+                return
+            f.seek(size)
+            tail = f.read()
+            fd, tmp_path = create_temp(journal_path)
+            with os.fdopen(fd, 'wb') as tmp:
+                tmp.write(tail)
+                new_ino = os.fstat(tmp.fileno()).st_ino
+            os.replace(tmp_path, journal_path)
+        # Keep the applied offset, shifted into the trimmed journal
+        known = stamps['journal']
+        if known is not None and known[0] == ino and known[1] >= size:
+            stamps['journal'] = (new_ino, known[1] - size)
+        else:
+            stamps['journal'] = (new_ino, 0)
+
+    @classmethod
+    def _open_journal(cls, mode: str) -> Optional[BinaryIO]:
+        """ Open the journal with an exclusive flock(), shared by every
+        process appending to or trimming it; None when it does not exist
+        and mode does not create it. The lock goes away with the file.
+        """
+        journal_path = ".db_{}.journal".format(cls.__name__)
+        while True:
+            try:
+                f = open(journal_path, mode)
+            except FileNotFoundError:
+                return None
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                if os.stat(journal_path).st_ino == os.fstat(f.fileno()).st_ino:
+                    return f
+            except FileNotFoundError:
+                pass
+            # Trimmed or removed while waiting for the lock
+            f.close()
+
+    @classmethod
+    def _journal(cls, op: str, objs: List[TypeVar('Base')]):
+        """ Append one mutation per object to the journal, in a single
+        write, in the journal storage mode; called with the write lock
+        held so records follow DATA's order
+        """
+        if storage_mode() != 'journal':
+            return
+        records = []
+        for obj in objs:
+            record = {'op': op, 'id': obj.id}
+            if op == 'put':
+                record['obj'] = obj.to_json(True)
+            records.append(json.dumps(record) + '\n')
+        line = ''.join(records).encode('utf-8')
+        with cls._open_journal('ab') as f:
+            start = f.seek(0, os.SEEK_END)
+            f.write(line)
+            f.flush()
+            st = os.fstat(f.fileno())
+        # Move the applied offset past the records unless another process
+        # appended in between; its records are then replayed on reload
+        stamps = STAMPS.get(cls.__name__)
+        if stamps is None or st.st_size != start + len(line):
+            return
+        if stamps['journal'] == (st.st_ino, start) or \
+                (stamps['journal'] is None and start == 0):
+            stamps['journal'] = (st.st_ino, st.st_size)
+
+    @classmethod
+    def _persist(cls, changes: int = 1):
+        """ Persist the last changes according to storage_mode(), once
+        the write lock is released
+        """
+        mode = storage_mode()
+        if mode == 'deferred':
+            cls._mark_dirty(changes)
+        elif mode == 'journal':
+            cls._maybe_compact()
+        else:
+            cls.save_to_file()
+
+    @classmethod
+    def _maybe_compact(cls):
+        """ Start a background compaction when the journal has grown past
+        BASE_JOURNAL_RATIO (default 1.0) times the snapshot size
+        """
+        s_class = cls.__name__
+        file_path = ".db_{}.json".format(s_class)
+        journal_path = ".db_{}.journal".format(s_class)
+        try:
+            journal_size = path.getsize(journal_path)
+        except OSError:
+            # Folded into a snapshot by another thread
+            return
+        if journal_size < JOURNAL_MIN_SIZE or s_class in _compacting:
+            return
+        ratio = float(getenv('BASE_JOURNAL_RATIO', JOURNAL_RATIO))
+        snapshot_size = path.getsize(file_path) \
+            if path.exists(file_path) else 0
+        if journal_size <= ratio * snapshot_size:
+            return
+        _compacting.add(s_class)
+
+        def _compact():
+            try:
+                cls.save_to_file()
+            finally:
+                _compacting.discard(s_class)
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+        threading.Thread(target=_compact, daemon=True).start()
+
+    @classmethod
+    def _mark_dirty(cls, count: int = 1):
+        """ Record unsaved changes, waking the flusher once
+        BASE_FLUSH_CHANGES changes are pending
+        """
+        global _flusher
+        with _dirty_lock:
+            changes = _dirty.get(cls.__name__, (cls, 0))[1] + count
+            _dirty[cls.__name__] = (cls, changes)
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_loop, daemon=True)
+                _flusher.start()
+        if changes >= int(getenv('BASE_FLUSH_CHANGES', FLUSH_CHANGES)):
+            _flush_event.set()
+
+    @classmethod
+    def flush(cls):
+        """ Save the dirty classes to file (only cls unless called on Base)
+
+        A class whose save fails is marked dirty again, with its pending
+        changes, and the first error is raised once every class was tried.
+        """
+        with _dirty_lock:
+            if cls is Base:
+                pending = list(_dirty.values())
+                _dirty.clear()
+            else:
+                pending = [_dirty.pop(cls.__name__)] \
+                    if cls.__name__ in _dirty else []
+        error = None
+        for dirty_cls, changes in pending:
+            try:
+                dirty_cls.save_to_file()
+            except Exception as e:
+                with _dirty_lock:
+                    count = _dirty.get(dirty_cls.__name__, (dirty_cls, 0))[1]
+                    _dirty[dirty_cls.__name__] = (dirty_cls, count + changes)
+                error = error or e
+        if error is not None:
+            raise error
 
     def save(self):
         """ Save current object
         """
         s_class = self.__class__.__name__
         self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        engine = self.__class__._engine()
+        if engine is not None:
+            fresh = self.__class__._sequence([self])
+            try:
+                engine.put(self.id, self.to_json(True))
+            except BaseException:
+                for obj in fresh:
+                    obj._seq = None
+                raise
+            return
+        with class_lock(s_class):
+            fresh = self.__class__._sequence([self])
+            try:
+                self.__class__._put(self.id, self)
+                self.__class__._journal('put', [self])
+            except BaseException:
+                for obj in fresh:
+                    obj._seq = None
+                raise
+        self.__class__._persist()
+
+    @classmethod
+    def save_many(cls, objs: Iterable[TypeVar('Base')]) \
+            -> List[TypeVar('Base')]:
+        """ Save several objects, persisting each class once
+
+        Every object is checked before any is stored: it must be an
+        instance of cls, with index values that can be computed and a
+        JSON-serializable dictionary. Objects are then inserted under one
+        write lock, and removed again if the batch fails half-way, and
+        written with a single snapshot, journal append or engine call,
+        instead of one per object as with save().
+        """
+        objs = list(objs)
+        groups = {}
+        for obj in objs:
+            if not isinstance(obj, cls):
+                raise TypeError("{} is not a {}".format(
+                    type(obj).__name__, cls.__name__))
+            groups.setdefault(type(obj), []).append(obj)
+        for klass, group in groups.items():
+            for obj in group:
+                klass._index_values(obj)
+                json.dumps(obj.to_json(True))
+        now = datetime.utcnow()
+        for klass, group in groups.items():
+            for obj in group:
+                obj.updated_at = now
+            engine = klass._engine()
+            if engine is not None:
+                fresh = klass._sequence(group)
+                try:
+                    engine.put_many([(obj.id, obj.to_json(True))
+                                     for obj in group])
+                except BaseException:
+                    for obj in fresh:
+                        obj._seq = None
+                    raise
+                continue
+            objs_data = DATA.setdefault(klass.__name__, {})
+            with class_lock(klass.__name__):
+                previous = [(obj.id, objs_data.get(obj.id)) for obj in group]
+                fresh = klass._sequence(group)
+                try:
+                    for obj in group:
+                        klass._put(obj.id, obj)
+                    klass._journal('put', group)
+                except BaseException:
+                    for obj_id, old in reversed(previous):
+                        if old is None:
+                            klass._delete(obj_id)
+                        else:
+                            klass._put(obj_id, old)
+                    for obj in fresh:
+                        obj._seq = None
+                    raise
+            klass._persist(len(group))
+        return objs
 
     def remove(self):
         """ Remove object
         """
         s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        engine = self.__class__._engine()
+        if engine is not None:
+            engine.delete(self.id)
+            return
+        with class_lock(s_class):
+            if not self.__class__._delete(self.id):
+                return
+            self.__class__._journal('del', [self])
+        self.__class__._persist()
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
         s_class = cls.__name__
+        engine = cls._engine()
+        if engine is not None:
+            return engine.count()
         return len(DATA[s_class].keys())
 
     @classmethod
@@ -118,12 +834,20 @@ class Base():
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
-        s_class = cls.__name__
-        return DATA[s_class].get(id)
+        engine = cls._engine()
+        if engine is not None:
+            obj_json = engine.get(id)
+            return None if obj_json is None else cls(**obj_json)
+        with class_lock(cls.__name__).reading():
+            return cls._hydrate(id)
 
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
+
+        Equality on an attribute listed in INDEXES is resolved through its
+        hash index; remaining attributes are checked on the candidates, so
+        only those are built from raw dictionaries.
         """
         s_class = cls.__name__
         def _search(obj):
@@ -133,5 +857,123 @@ class Base():
                 if (getattr(obj, k) != v):
                     return False
             return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+
+        engine = cls._engine()
+        if engine is not None:
+            return list(filter(_search, (cls(**obj_json) for obj_json
+                                         in engine.search(attributes))))
+
+        with class_lock(s_class).reading():
+            objs = DATA[s_class]
+            indexes = INDEX.get(s_class, {})
+            for k, v in attributes.items():
+                if k in cls.INDEXES and k in indexes:
+                    try:
+                        ids = indexes[k].get(v, {})
+                    except TypeError:
+                        continue
+                    return list(filter(_search,
+                                       (cls._hydrate(i) for i in ids)))
+            return list(filter(_search, (cls._hydrate(i) for i in objs)))
+
+    @classmethod
+    def query(cls, order_by: str = 'created_at',
+              gt: Union[datetime, str] = None,
+              gte: Union[datetime, str] = None,
+              lt: Union[datetime, str] = None,
+              lte: Union[datetime, str] = None,
+              after: Optional[Tuple[str, str]] = None,
+              limit: Optional[int] = None,
+              reverse: bool = False) -> List[TypeVar('Base')]:
+        """ Objects ordered by an attribute, then by ID
+
+        gt, gte, lt and lte bound the attribute value; they are compared
+        through order_value(), so timestamps to the second. after is the
+        order_key() of the last object of a previous page: pages by '_seq'
+        are stable while objects are saved, since it only grows, whereas
+        a new object can share the timestamp of the last object of a page
+        and sort before it. At most limit
+        objects are returned, from the highest value down when reverse.
+
+        Attributes of ORDERED_INDEXES are served by bisecting their sorted
+        index, so a page costs O(log n) plus the objects it returns; other
+        attributes, and storage engines, sort a full scan.
+        """
+        s_class = cls.__name__
+        with class_lock(s_class).reading():
+            if cls._engine() is None and order_by in cls.ORDERED_INDEXES:
+                keys = ORDER.get(s_class, {}).get(order_by, [])
+                fetch = cls._hydrate
+            else:
+                objs = {obj.id: obj for obj in cls.all()}
+                keys = sorted(obj.order_key(order_by) for obj in objs.values())
+                fetch = objs.get
+
+            # (value,) sorts before any (value, id), (value, HIGH) after them
+            high = chr(0x10ffff)
+            start, stop = 0, len(keys)
+            if gte is not None:
+                start = max(start, bisect_left(keys, (order_value(gte),)))
+            if gt is not None:
+                start = max(start, bisect_right(keys, (order_value(gt), high)))
+            if lte is not None:
+                stop = min(stop, bisect_right(keys, (order_value(lte), high)))
+            if lt is not None:
+                stop = min(stop, bisect_left(keys, (order_value(lt),)))
+            if after is not None:
+                if reverse:
+                    stop = min(stop, bisect_left(keys, tuple(after)))
+                else:
+                    start = max(start, bisect_right(keys, tuple(after)))
+            if start >= stop:
+                return []
+            if limit is not None:
+                if reverse:
+                    start = max(start, stop - limit)
+                else:
+                    stop = min(stop, start + limit)
+            page = keys[start:stop]
+            if reverse:
+                page.reverse()
+            return list(filter(None, (fetch(obj_id) for _, obj_id in page)))
+
+    @classmethod
+    def query_iter(cls, order_by: str = 'created_at',
+                   after: Optional[Tuple[str, str]] = None,
+                   chunk_size: int = QUERY_CHUNK_SIZE,
+                   **bounds) -> Iterator[TypeVar('Base')]:
+        """ Iterate over the result of query() without a limit, lazily
+
+        Objects are fetched chunk_size at a time through the ordered
+        index, each chunk starting after the last object of the previous
+        one, so memory does not grow with the number of objects. Without
+        an ordered index (other attributes, storage engines) the single
+        sorted scan of query() is iterated instead.
+        """
+        if cls._engine() is not None or order_by not in cls.ORDERED_INDEXES:
+            yield from cls.query(order_by, after=after, **bounds)
+            return
+        while True:
+            objs = cls.query(order_by, after=after, limit=chunk_size,
+                             **bounds)
+            yield from objs
+            if len(objs) < chunk_size:
+                return
+            after = objs[-1].order_key(order_by)
+
+
+def _flush_loop():
+    """ Background flusher of the deferred storage mode
+    """
+    interval = float(getenv('BASE_FLUSH_INTERVAL', FLUSH_INTERVAL))
+    while True:
+        _flush_event.wait(interval)
+        _flush_event.clear()
+        try:
+            Base.flush()
+        except Exception:
+            # The classes stay dirty and are retried after the interval
+            logging.getLogger(__name__).exception("Deferred flush failed")
+
+
+atexit.register(Base.flush)
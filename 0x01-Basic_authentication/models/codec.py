@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+""" Codec module: serializers for the Base snapshot files
+"""
+from os import getenv
+import json
+import marshal
+import pickle
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+PICKLE_MAGIC = b'\x00BASE-PICKLE\n'
+MARSHAL_MAGIC = b'\x00BASE-MARSHAL\n'
+PICKLE_PROTOCOL = min(5, pickle.HIGHEST_PROTOCOL)
+
+
+def _json_dumps(objs: dict) -> bytes:
+    """ Encode with orjson when installed, stdlib json otherwise
+    """
+    if orjson is not None:
+        return orjson.dumps(objs)
+    return json.dumps(objs).encode('utf-8')
+
+
+CODECS = {
+    'json': lambda objs: json.dumps(objs).encode('utf-8'),
+    'orjson': _json_dumps,
+    'pickle': lambda objs: PICKLE_MAGIC + pickle.dumps(objs,
+                                                       PICKLE_PROTOCOL),
+    'marshal': lambda objs: MARSHAL_MAGIC + marshal.dumps(objs),
+}
+# Binary snapshot headers, with the codec that must be selected to read
+# them and its decoder
+BINARY_CODECS = (
+    (PICKLE_MAGIC, 'pickle', pickle.loads),
+    (MARSHAL_MAGIC, 'marshal', marshal.loads),
+)
+
+
+def codec_name() -> str:
+    """ Codec used for writing, from BASE_CODEC: json (default), orjson
+    (falls back to json when orjson is not installed), pickle or marshal.
+    Binary snapshots are only meant for files written by this process,
+    and are only read back while their codec is selected.
+    """
+    name = getenv('BASE_CODEC', 'json')
+    if name not in CODECS:
+        raise ValueError("Unknown BASE_CODEC: {}".format(name))
+    return name
+
+
+def dumps(objs: dict, name: str = None) -> bytes:
+    """ Serialize a snapshot with the selected codec
+    """
+    return CODECS[name or codec_name()](objs)
+
+
+def loads(data: bytes) -> dict:
+    """ Deserialize a snapshot, detecting its codec from the header
+
+    A crafted pickle runs arbitrary code, and marshal data is no safer,
+    so a binary snapshot raises ValueError unless BASE_CODEC selects its
+    codec: a JSON deployment never unpickles a file it did not write.
+    """
+    for magic, name, decode in BINARY_CODECS:
+        if data.startswith(magic):
+            if codec_name() != name:
+                raise ValueError("Refusing to read a {} snapshot without "
+                                 "BASE_CODEC={}".format(name, name))
+            return decode(data[len(magic):])
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
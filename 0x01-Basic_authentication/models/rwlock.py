@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+""" Readers-writer lock module
+"""
+import threading
+
+
+class RWLock():
+    """ Lock held either by any number of readers or by one writer
+
+    The write side is used like a threading.RLock (with, acquire and
+    release) and the read side through `with lock.reading():`. Both sides
+    are reentrant and the writer may also read, but a reader cannot
+    upgrade to writer. Waiting writers hold back new readers so a steady
+    flow of reads does not starve them.
+    """
+
+    def __init__(self):
+        """ Initialize an unlocked lock
+        """
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._local = threading.local()
+        self._readers = 0
+        self._writer = None
+        self._writes = 0
+        self._waiting = 0
+        self._reading = _ReadSide(self)
+
+    def acquire_read(self):
+        """ Take the read side, waiting for the writer to finish
+        """
+        local = self._local
+        depth = getattr(local, 'reads', 0)
+        if depth:
+            local.reads = depth + 1
+            return
+        me = threading.get_ident()
+        with self._lock:
+            if self._writer != me:
+                while self._writer is not None or self._waiting:
+                    self._cond.wait()
+            self._readers += 1
+        local.reads = 1
+
+    def release_read(self):
+        """ Release the read side
+        """
+        local = self._local
+        local.reads -= 1
+        if local.reads:
+            return
+        with self._lock:
+            self._readers -= 1
+            if not self._readers and self._waiting:
+                self._cond.notify_all()
+
+    def reading(self) -> '_ReadSide':
+        """ Context manager holding the read side
+        """
+        return self._reading
+
+    def acquire(self) -> bool:
+        """ Take the write side, waiting for readers and any other writer
+        """
+        me = threading.get_ident()
+        with self._lock:
+            if self._writer == me:
+                self._writes += 1
+                return True
+            if getattr(self._local, 'reads', 0):
+                raise RuntimeError("Cannot upgrade a read lock to write")
+            self._waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting -= 1
+            self._writer = me
+            self._writes = 1
+            return True
+
+    def release(self):
+        """ Release the write side
+        """
+        with self._lock:
+            if self._writer != threading.get_ident():
+                raise RuntimeError("Cannot release an un-acquired lock")
+            self._writes -= 1
+            if not self._writes:
+                self._writer = None
+                self._cond.notify_all()
+
+    def __enter__(self) -> bool:
+        """ Take the write side
+        """
+        return self.acquire()
+
+    def __exit__(self, *args):
+        """ Release the write side
+        """
+        self.release()
+
+
+class _ReadSide():
+    """ Context manager of the read side of an RWLock
+    """
+
+    __slots__ = ('acquire', 'release')
+
+    def __init__(self, lock: RWLock):
+        """ Bind to lock
+        """
+        self.acquire = lock.acquire_read
+        self.release = lock.release_read
+
+    def __enter__(self):
+        """ Take the read side
+        """
+        self.acquire()
+
+    def __exit__(self, *args):
+        """ Release the read side
+        """
+        self.release()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+""" SQLite storage engine
+"""
+from typing import Iterator, List, Optional, Tuple
+from os import getenv
+import json
+import os
+import sqlite3
+import threading
+
+
+SQLITE_PATH = ".db.sqlite3"
+BUSY_TIMEOUT = 30.0
+# Values that can be compared by SQLite the way Python compares them
+SQL_TYPES = (str, int, float, type(None))
+
+
+class SqliteStorage():
+    """ Objects of one class stored as rows of a table named after it
+
+    Each row holds the ID, one column per indexed attribute and the JSON
+    dictionary of the object. The database (BASE_SQLITE_PATH, default
+    .db.sqlite3) runs in WAL mode, so several processes read while one
+    writes, and every operation is a single statement in autocommit mode.
+    Connections are per thread and per process.
+    """
+
+    def __init__(self, s_class: str, indexes: tuple = ()):
+        """ Open the database and create the table of a class
+        """
+        self.file_path = getenv('BASE_SQLITE_PATH', SQLITE_PATH)
+        self.s_class = s_class
+        self.table = '"{}"'.format(s_class)
+        self.indexes = tuple(indexes)
+        self._local = threading.local()
+        self.reload()
+
+    def _connection(self) -> sqlite3.Connection:
+        """ Connection of the calling thread, reopened after a fork
+        """
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.file_path, timeout=BUSY_TIMEOUT,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            local.conn, local.pid = conn, os.getpid()
+        return local.conn
+
+    def reload(self):
+        """ Create the table and its indexes, adding the columns of
+        attributes indexed since it was created
+        """
+        conn = self._connection()
+        conn.execute('CREATE TABLE IF NOT EXISTS {} '
+                     '(id TEXT PRIMARY KEY, data TEXT NOT NULL)'
+                     .format(self.table))
+        columns = [row[1] for row in
+                   conn.execute('PRAGMA table_info({})'.format(self.table))]
+        for k in self.indexes:
+            if k not in columns:
+                conn.execute('ALTER TABLE {} ADD COLUMN "{}"'
+                             .format(self.table, k))
+                conn.execute('UPDATE {} SET "{}" = json_extract(data, ?)'
+                             .format(self.table, k), ('$.' + k,))
+            conn.execute('CREATE INDEX IF NOT EXISTS "{}_{}" ON {} ("{}")'
+                         .format(self.s_class, k, self.table, k))
+        self._put_sql = 'INSERT OR REPLACE INTO {} (id, {}data) ' \
+                        'VALUES (?, {}?)'.format(
+                            self.table,
+                            ''.join('"{}", '.format(k) for k in self.indexes),
+                            '?, ' * len(self.indexes))
+
+    def get(self, obj_id: str) -> Optional[dict]:
+        """ Return the raw dictionary stored under obj_id
+        """
+        row = self._connection().execute(
+            'SELECT data FROM {} WHERE id = ?'.format(self.table),
+            (obj_id,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def _columns(self, obj_json: dict) -> list:
+        """ Values of the indexed columns of an object; values SQLite
+        cannot store or compare (lists, dicts) are left NULL, so they are
+        only found by the scan of search()
+        """
+        values = [obj_json.get(k) for k in self.indexes]
+        return [v if type(v) in SQL_TYPES else None for v in values]
+
+    def put(self, obj_id: str, obj_json: dict):
+        """ Store the raw dictionary of an object
+        """
+        self._connection().execute(
+            self._put_sql,
+            [obj_id] + self._columns(obj_json) + [json.dumps(obj_json)])
+
+    def put_many(self, items: List[Tuple[str, dict]]):
+        """ Store the raw dictionaries of several objects in one
+        transaction
+        """
+        rows = [[obj_id] + self._columns(obj_json) + [json.dumps(obj_json)]
+                for obj_id, obj_json in items]
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(self._put_sql, rows)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def delete(self, obj_id: str) -> bool:
+        """ Delete an object, returning False when it does not exist
+        """
+        cursor = self._connection().execute(
+            'DELETE FROM {} WHERE id = ?'.format(self.table), (obj_id,))
+        return cursor.rowcount > 0
+
+    def count(self) -> int:
+        """ Number of stored objects
+        """
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM {}'.format(self.table)).fetchone()[0]
+
+    def all(self) -> Iterator[dict]:
+        """ Iterate over the raw dictionaries of all objects
+        """
+        return self.search({})
+
+    def search(self, attributes: dict) -> Iterator[dict]:
+        """ Iterate over candidates for an equality search: the objects
+        matching every attribute that has a column (ID or indexed)
+        """
+        where, params = [], []
+        for k, v in attributes.items():
+            if (k == 'id' or k in self.indexes) and type(v) in SQL_TYPES:
+                where.append('"{}" IS ?'.format(k))
+                params.append(v)
+        sql = 'SELECT data FROM {}'.format(self.table)
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        cursor = self._connection().execute(sql, params)
+        return (json.loads(row[0]) for row in cursor)
+
+    def flush(self):
+        """ Copy committed transactions from the WAL into the database
+        """
+        self._connection().execute('PRAGMA wal_checkpoint(PASSIVE)')
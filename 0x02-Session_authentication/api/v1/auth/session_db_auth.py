@@ -27,7 +27,6 @@ class SessionDBAuth(SessionExpAuth):
         # Store session in the database
         user_session = UserSession(user_id=user_id, session_id=session_id)
         user_session.save()
-        UserSession.save_to_file()
 
         return session_id
 
@@ -93,7 +92,6 @@ class SessionDBAuth(SessionExpAuth):
 
         try:
             user_session.remove()
-            UserSession.save_to_file()
         except Exception:
             return False
 
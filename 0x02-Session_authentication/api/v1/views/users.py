@@ -2,18 +2,113 @@
 """ Module of Users views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from flask import Response, abort, jsonify, request
 from models.user import User
+from typing import Iterable, Iterator, List, Optional, Tuple
+import binascii
+import json
+
+
+MAX_PAGE_SIZE = 1000
+MAX_BULK_SIZE = 10000
+NDJSON_TYPES = ('application/x-ndjson', 'application/jsonl')
+
+
+def encode_cursor(key: Tuple[str, str]) -> str:
+    """ Opaque cursor pointing after the user with this page key
+    """
+    return urlsafe_b64encode(','.join(key).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Optional[Tuple[str, str]]:
+    """ Page key of a cursor, or None if it is malformed
+    """
+    try:
+        seq, user_id = urlsafe_b64decode(
+            cursor.encode()).decode().split(',', 1)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    # Empty for users saved before insertion sequences existed
+    if seq and not (seq.isdigit() and seq.isascii()):
+        return None
+    return (seq, user_id)
+
+
+def users_page(after: Optional[Tuple[str, str]],
+               limit: Optional[int]) -> Tuple[List[User], Optional[str]]:
+    """ Users in the order they were added that come after the cursor
+    key, at most limit of them, with the cursor of the next page
+
+    Users are ordered by their insertion sequence, not created_at: a
+    user added while paging shares the second of the last user of a page
+    often enough, and would be skipped when its ID sorts first.
+    """
+    users = User.query('_seq', after=after,
+                       limit=None if limit is None else limit + 1)
+    if limit is None or len(users) <= limit:
+        return users, None
+    users = users[:limit]
+    return users, encode_cursor(users[-1].order_key('_seq'))
+
+
+def stream_users(users: Iterable[User]) -> Iterator[str]:
+    """ Yield a JSON array of users one element at a time
+    """
+    yield '['
+    for i, user in enumerate(users):
+        yield (',' if i else '') + json.dumps(user.to_json())
+    yield ']'
 
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters (optional):
+      - limit: maximum number of users returned, in the order they were
+        added
+      - cursor: value of the X-Next-Cursor header of the previous page
+      - stream: when set, the JSON array is written incrementally; without
+        limit, users are read from the store as they are written
     Return:
       - list of all User objects JSON represented
+      - X-Next-Cursor header when more users follow the page
+      - 400 if limit or cursor is invalid
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    limit = request.args.get('limit')
+    cursor = request.args.get('cursor')
+    stream = request.args.get('stream')
+    if limit is None and cursor is None and stream is None:
+        all_users = [user.to_json() for user in User.all()]
+        return jsonify(all_users)
+
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if not 0 < limit <= MAX_PAGE_SIZE:
+            return jsonify({'error': "limit must be between 1 and {}"
+                            .format(MAX_PAGE_SIZE)}), 400
+    after = None
+    if cursor is not None:
+        after = decode_cursor(cursor)
+        if after is None:
+            return jsonify({'error': "Invalid cursor"}), 400
+
+    if stream is not None and limit is None:
+        # Unbounded: walk the insertion sequence index while writing
+        return Response(stream_users(User.query_iter('_seq', after)),
+                        mimetype='application/json')
+
+    users, next_cursor = users_page(after, limit)
+    if stream is not None:
+        response = Response(stream_users(users), mimetype='application/json')
+    else:
+        response = jsonify([user.to_json() for user in users])
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -87,6 +182,88 @@ def create_user() -> str:
         return jsonify({'error': f"Can't create User: {e}"}), 400
 
 
+def bulk_items() -> Optional[list]:
+    """ Items of a bulk request: a JSON array, or one JSON value per line
+    for NDJSON bodies (a line that does not parse becomes None); None if
+    the body is malformed
+    """
+    if request.mimetype in NDJSON_TYPES:
+        items = []
+        for line in request.stream:
+            if len(items) > MAX_BULK_SIZE:
+                break
+            if line.strip():
+                try:
+                    items.append(json.loads(line))
+                except ValueError:
+                    items.append(None)
+        return items
+    try:
+        items = request.get_json()
+    except Exception:
+        return None
+    return items if type(items) is list else None
+
+
+def build_user(rj) -> Tuple[Optional[User], Optional[str]]:
+    """ New unsaved User from one item of a bulk request, or the error
+    that prevents its creation
+    """
+    if type(rj) is not dict:
+        return None, "Wrong format"
+    email = rj.get("email")
+    password = rj.get("password")
+    if not email or not password:
+        return None, "email and password are required"
+    try:
+        user = User()
+        user.email = email
+        user.password = password
+        user.first_name = rj.get("first_name")
+        user.last_name = rj.get("last_name")
+    except Exception as e:
+        return None, f"Can't create User: {e}"
+    return user, None
+
+
+@app_views.route('/users/bulk', methods=['POST'], strict_slashes=False)
+def create_users() -> str:
+    """ POST /api/v1/users/bulk
+    Body: JSON array of user objects (same fields as POST /api/v1/users),
+    or one object per line with Content-Type application/x-ndjson
+    Return:
+      - list of {"index", "status", "user" or "error"} per item, in order
+      - 400 if the body is malformed or no User could be created
+      - 413 if there are more than MAX_BULK_SIZE items
+    """
+    items = bulk_items()
+    if items is None:
+        return jsonify({'error': "Wrong format"}), 400
+    if len(items) > MAX_BULK_SIZE:
+        return jsonify({'error': "At most {} users per request"
+                        .format(MAX_BULK_SIZE)}), 413
+
+    # Built in a plain loop: sha256 holds the GIL on short passwords, so
+    # threads would only add the cost of a pool per request
+    built = [build_user(rj) for rj in items]
+    users = [user for user, _ in built if user is not None]
+    try:
+        User.save_many(users)
+    except Exception as e:
+        error = f"Can't create User: {e}"
+        built = [(None, msg or error) for _, msg in built]
+
+    results = []
+    for i, (user, error) in enumerate(built):
+        if user is None:
+            results.append({'index': i, 'status': 400, 'error': error})
+        else:
+            results.append({'index': i, 'status': 201,
+                            'user': user.to_json()})
+    created = any(user is not None for user, _ in built)
+    return jsonify(results), 201 if created else 400
+
+
 @app_views.route('/users/<user_id>', methods=['PUT'], strict_slashes=False)
 def update_user(user_id: str) -> str:
     """ PUT /api/v1/users/:id
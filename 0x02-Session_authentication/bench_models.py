@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+""" Benchmarks of the models storage
+
+Usage: ./bench_models.py {codec,memory,threads}
+                         [--sizes 10000,100000,1000000]
+                         [--threads 1,2,4,8] [--duration 2] [--writes 0.1]
+
+codec: save_to_file / load_from_file time per BASE_CODEC and user count
+memory: memory held by hydrated User objects, per 100k objects
+threads: throughput and errors of concurrent get/search/query/save calls,
+         with the deferred flusher snapshotting DATA in the background
+"""
+import argparse
+import collections
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from models import base, codec
+from models.user import User
+
+
+def make_users(count: int) -> dict:
+    """ Raw dictionaries of count users, as loaded from a snapshot
+    """
+    users = {}
+    for i in range(count):
+        user = User(email='user{}@example.com'.format(i),
+                    first_name='First{}'.format(i), last_name='Last')
+        user.password = 'pwd{}'.format(i)
+        users[user.id] = user.to_json(True)
+    return users
+
+
+def bench_codec(sizes: list):
+    """ Time saving and loading a snapshot of each size with every codec
+    """
+    names = [n for n in codec.CODECS if n != 'orjson' or codec.orjson]
+    print('{:>9} {:>8} {:>9} {:>9} {:>9}'.format(
+        'users', 'codec', 'save (s)', 'load (s)', 'size (MB)'))
+    for size in sizes:
+        users = make_users(size)
+        for name in names:
+            os.environ['BASE_CODEC'] = name
+            base.DATA['User'] = dict(users)
+            start = time.perf_counter()
+            User.save_to_file()
+            saved = time.perf_counter() - start
+            # DATA was replaced behind the indexes: force a full reload
+            base.STAMPS.pop('User', None)
+            start = time.perf_counter()
+            User.load_from_file()
+            loaded = time.perf_counter() - start
+            assert User.count() == size
+            print('{:>9} {:>8} {:>9.3f} {:>9.3f} {:>9.1f}'.format(
+                size, name, saved, loaded,
+                os.path.getsize('.db_User.json') / (1 << 20)))
+
+
+def bench_memory(sizes: list):
+    """ Measure the memory allocated by hydrating every user
+    """
+    print('{:>9} {:>14} {:>14}'.format('users', 'MB', 'MB per 100k'))
+    for size in sizes:
+        users = make_users(size)
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        objs = [User(**user) for user in users.values()]
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        del objs
+        mb = used / (1 << 20)
+        print('{:>9} {:>14.1f} {:>14.1f}'.format(size, mb,
+                                                 mb * 100000 / size))
+
+
+def stress_worker(ids: list, emails: list, until: float, writes: float,
+                  ops: list, errors: list):
+    """ Mix reads and updates of random users until the deadline, then
+    append the number of operations to ops and failures to errors
+    """
+    rand = random.Random()
+    done = 0
+    while time.perf_counter() < until:
+        try:
+            pick = rand.random()
+            if pick < writes:
+                user = User.get(rand.choice(ids))
+                user.last_name = 'Last{}'.format(done)
+                user.save()
+            elif pick < 0.5:
+                assert User.get(rand.choice(ids)) is not None
+            elif pick < 0.8:
+                assert len(User.search({'email': rand.choice(emails)})) == 1
+            else:
+                User.query(limit=20, reverse=True)
+            done += 1
+        except Exception as e:
+            errors.append(type(e).__name__)
+    ops.append(done)
+
+
+def bench_threads(sizes: list, counts: list, duration: float,
+                  writes: float):
+    """ Run stress_worker on a growing number of threads
+    """
+    os.environ['BASE_STORAGE'] = 'deferred'
+    os.environ['BASE_FLUSH_INTERVAL'] = '0.05'
+    print('{:>9} {:>8} {:>12} {:>8}'.format(
+        'users', 'threads', 'ops/s', 'errors'))
+    for size in sizes:
+        users = make_users(size)
+        ids = list(users)
+        emails = [user['email'] for user in users.values()]
+        base.DATA['User'] = dict(users)
+        User.save_to_file()
+        base.STAMPS.pop('User', None)
+        User.load_from_file()
+        for count in counts:
+            ops, errors = [], []
+            until = time.perf_counter() + duration
+            threads = [threading.Thread(target=stress_worker,
+                                        args=(ids, emails, until, writes,
+                                              ops, errors))
+                       for _ in range(count)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            User.flush()
+            User.load_from_file()
+            if User.count() != size:
+                errors.append('lost objects')
+            print('{:>9} {:>8} {:>12.0f} {:>8} {}'.format(
+                size, count, sum(ops) / duration, len(errors),
+                dict(collections.Counter(errors)) if errors else ''))
+
+
+def main():
+    """ Run the selected benchmark in a scratch directory
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('benchmark', choices=['codec', 'memory', 'threads'])
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help='comma separated object counts')
+    parser.add_argument('--threads', default='1,2,4,8',
+                        help='comma separated thread counts')
+    parser.add_argument('--duration', type=float, default=2.0,
+                        help='seconds per thread count')
+    parser.add_argument('--writes', type=float, default=0.1,
+                        help='fraction of operations that save a user')
+    args = parser.parse_args()
+    sizes = [int(n) for n in args.sizes.split(',')]
+
+    os.environ.pop('BASE_STORAGE', None)
+    os.chdir(tempfile.mkdtemp(prefix='bench_models.'))
+    if args.benchmark == 'codec':
+        bench_codec(sizes)
+    elif args.benchmark == 'memory':
+        bench_memory(sizes)
+    elif args.benchmark == 'threads':
+        bench_threads(sizes, [int(n) for n in args.threads.split(',')],
+                      args.duration, args.writes)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+""" JSON-lines storage engine
+"""
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+from os import path
+import fcntl
+import json
+import mmap
+import os
+import tempfile
+import threading
+
+
+COMPACT_MIN_SIZE = 1 << 20
+
+
+class JsonLinesStorage():
+    """ Objects of one class stored one per line in .db_<Class>.jsonl
+
+    Every put or delete is appended to the data file. A side index,
+    .db_<Class>.jsonl.idx, maps each ID to the byte span of its latest
+    line and records the values of the indexed attributes, so opening the
+    store never parses the objects themselves and get() reads one line
+    through mmap. The data file is compacted once dead lines outweigh
+    live ones.
+
+    Several processes (or instances) can share the files: appends and
+    compactions hold an exclusive flock on .db_<Class>.jsonl.lock, and
+    every operation first catches up with the index entries written by
+    the others, or reloads when a compaction replaced the data file.
+    """
+
+    def __init__(self, s_class: str, indexes: tuple = ()):
+        """ Open (or create) the store of a class
+        """
+        self.file_path = ".db_{}.jsonl".format(s_class)
+        self.index_path = self.file_path + ".idx"
+        self.lock_path = self.file_path + ".lock"
+        self.indexes = tuple(indexes)
+        self._lock = threading.RLock()
+        self._lock_f = open(self.lock_path, 'ab')
+        self._locked = 0
+        self._data_f = None
+        self._index_f = None
+        self._read_f = None
+        self._map = None
+        self.reload()
+
+    @contextmanager
+    def _file_lock(self):
+        """ Hold the exclusive flock shared with the other processes using
+        the files (reentrant within the instance)
+        """
+        with self._lock:
+            if not self._locked:
+                fcntl.flock(self._lock_f, fcntl.LOCK_EX)
+            self._locked += 1
+            try:
+                yield
+            finally:
+                self._locked -= 1
+                if not self._locked:
+                    fcntl.flock(self._lock_f, fcntl.LOCK_UN)
+
+    def reload(self):
+        """ Re-read the side index and pick up lines appended to the data
+        file after its last entry
+        """
+        with self._file_lock():
+            self._load()
+
+    def _load(self):
+        """ Body of reload(), under the file lock
+        """
+        self._close()
+        self.spans = {}
+        self.values = {}
+        self.lookup = {k: {} for k in self.indexes}
+        self.live = 0
+        self.end = 0
+        if not path.exists(self.file_path):
+            open(self.file_path, 'ab').close()
+        self.ino = os.stat(self.file_path).st_ino
+        end = self._read_index(self.ino)
+        if end is None:
+            header = (json.dumps({'ino': self.ino}) + '\n').encode('utf-8')
+            with open(self.index_path, 'wb') as f:
+                f.write(header)
+            self.index_end = len(header)
+            end = 0
+        self._data_f = open(self.file_path, 'ab')
+        self._index_f = open(self.index_path, 'ab')
+        self._read_f = open(self.file_path, 'rb')
+        self._recover(end)
+
+    def _sync(self):
+        """ Under the file lock, catch up with the changes of the other
+        processes: reload when the data file was replaced or shrunk, or
+        apply the index entries appended since the last operation
+        """
+        try:
+            st = os.stat(self.file_path)
+        except FileNotFoundError:
+            st = None
+        if st is None or st.st_ino != self.ino or st.st_size < self.end:
+            self._load()
+        elif st.st_size > self.end:
+            with open(self.index_path, 'rb') as f:
+                f.seek(self.index_end)
+                end = self._read_entries(f)
+            self._recover(max(self.end, end))
+
+    def _refresh(self):
+        """ Before a read, sync when the data file changed since the last
+        operation
+        """
+        try:
+            st = os.stat(self.file_path)
+            changed = st.st_ino != self.ino or st.st_size != self.end
+        except FileNotFoundError:
+            changed = True
+        if changed:
+            with self._file_lock():
+                self._sync()
+
+    def _read_index(self, ino: int) -> Optional[int]:
+        """ Load the side index, returning the end offset of its last
+        entry, or None when it is missing or belongs to another data file
+        """
+        if not path.exists(self.index_path):
+            return None
+        with open(self.index_path, 'rb') as f:
+            header = f.readline()
+            try:
+                if json.loads(header).get('ino') != ino:
+                    return None
+            except ValueError:
+                return None
+            self.index_end = len(header)
+            return self._read_entries(f)
+
+    def _read_entries(self, f: BinaryIO) -> int:
+        """ Apply the complete index entries read from f, which is at
+        self.index_end, returning the end offset of the last one
+        """
+        end = 0
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                obj_id, start, stop, values = json.loads(line)
+            except ValueError:
+                break
+            self.index_end += len(line)
+            if start is None:
+                self._forget(obj_id)
+            else:
+                self._remember(obj_id, start, stop, values)
+                end = max(end, stop)
+        return end
+
+    def _recover(self, start: int):
+        """ Index the complete lines of the data file past start and drop a
+        torn last line
+        """
+        size = os.fstat(self._read_f.fileno()).st_size
+        if size <= start:
+            self.end = size
+            return
+        self._read_f.seek(start)
+        offset = start
+        for line in self._read_f:
+            if not line.endswith(b'\n'):
+                break
+            stop = offset + len(line)
+            record = json.loads(line)
+            if '__delete__' in record:
+                self._forget(record['__delete__'])
+                self._append_index([record['__delete__'], None, None, None])
+            else:
+                values = [record.get(k) for k in self.indexes]
+                self._remember(record['id'], offset, stop, values)
+                self._append_index([record['id'], offset, stop, values])
+            offset = stop
+        if offset < size:
+            self._data_f.truncate(offset)
+        self.end = offset
+
+    def _remember(self, obj_id: str, start: int, stop: int, values: List):
+        """ Point obj_id at a new line
+        """
+        self._forget(obj_id)
+        self.spans[obj_id] = (start, stop)
+        self.live += stop - start
+        values = tuple(values)
+        self.values[obj_id] = values
+        for k, v in zip(self.indexes, values):
+            try:
+                self.lookup[k].setdefault(v, {})[obj_id] = None
+            except TypeError:
+                # Unhashable values stay out of the hash index: they never
+                # equal a hashable search value
+                pass
+
+    def _forget(self, obj_id: str):
+        """ Drop obj_id from the spans and the hash indexes
+        """
+        span = self.spans.pop(obj_id, None)
+        if span is None:
+            return
+        self.live -= span[1] - span[0]
+        for k, v in zip(self.indexes, self.values.pop(obj_id)):
+            try:
+                ids = self.lookup[k][v]
+            except TypeError:
+                continue
+            del ids[obj_id]
+            if not ids:
+                del self.lookup[k][v]
+
+    def _append(self, line: bytes) -> int:
+        """ Append a line to the data file, returning its offset
+        """
+        start = os.fstat(self._data_f.fileno()).st_size
+        self._data_f.write(line)
+        self._data_f.flush()
+        self.end = start + len(line)
+        return start
+
+    def _append_index(self, *entries: List):
+        """ Append entries to the side index
+        """
+        data = ''.join(json.dumps(entry) + '\n' for entry in entries)
+        data = data.encode('utf-8')
+        self._index_f.write(data)
+        self._index_f.flush()
+        self.index_end += len(data)
+
+    def _close(self):
+        """ Close the mapping and the file handles
+        """
+        for f in (self._map, self._data_f, self._index_f, self._read_f):
+            if f is not None:
+                f.close()
+        self._map = self._data_f = self._index_f = self._read_f = None
+
+    def get(self, obj_id: str) -> Optional[dict]:
+        """ Return the raw dictionary stored under obj_id
+        """
+        self._refresh()
+        return self._get(obj_id)
+
+    def _get(self, obj_id: str) -> Optional[dict]:
+        """ get() without the check for changes of other processes
+        """
+        with self._lock:
+            span = self.spans.get(obj_id)
+            if span is None:
+                return None
+            start, stop = span
+            if self._map is None or len(self._map) < stop:
+                if self._map is not None:
+                    self._map.close()
+                self._map = mmap.mmap(self._read_f.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+            return json.loads(self._map[start:stop])
+
+    def put(self, obj_id: str, obj_json: dict):
+        """ Store the raw dictionary of an object
+        """
+        line = (json.dumps(obj_json) + '\n').encode('utf-8')
+        values = [obj_json.get(k) for k in self.indexes]
+        with self._file_lock():
+            self._sync()
+            start = self._append(line)
+            self._append_index([obj_id, start, start + len(line), values])
+            self._remember(obj_id, start, start + len(line), values)
+            self._maybe_compact()
+
+    def put_many(self, items: List[Tuple[str, dict]]):
+        """ Store the raw dictionaries of several objects with one append
+        to the data file and one to the side index
+        """
+        lines = [(obj_id, (json.dumps(obj_json) + '\n').encode('utf-8'),
+                  [obj_json.get(k) for k in self.indexes])
+                 for obj_id, obj_json in items]
+        with self._file_lock():
+            self._sync()
+            offset = self._append(b''.join(line for _, line, _ in lines))
+            entries = []
+            for obj_id, line, values in lines:
+                entries.append([obj_id, offset, offset + len(line), values])
+                offset += len(line)
+            self._append_index(*entries)
+            for entry in entries:
+                self._remember(*entry)
+            self._maybe_compact()
+
+    def delete(self, obj_id: str) -> bool:
+        """ Delete an object, returning False when it does not exist
+        """
+        with self._file_lock():
+            self._sync()
+            if obj_id not in self.spans:
+                return False
+            line = json.dumps({'__delete__': obj_id}) + '\n'
+            self._append(line.encode('utf-8'))
+            self._append_index([obj_id, None, None, None])
+            self._forget(obj_id)
+            self._maybe_compact()
+            return True
+
+    def count(self) -> int:
+        """ Number of stored objects
+        """
+        self._refresh()
+        return len(self.spans)
+
+    def all(self) -> Iterator[dict]:
+        """ Iterate over the raw dictionaries of all objects
+        """
+        self._refresh()
+        for obj_id in list(self.spans):
+            obj_json = self._get(obj_id)
+            if obj_json is not None:
+                yield obj_json
+
+    def search(self, attributes: dict) -> Iterator[dict]:
+        """ Iterate over candidates for an equality search: the objects
+        matching the first indexed attribute, or all of them
+        """
+        self._refresh()
+        for k, v in attributes.items():
+            if k in self.lookup:
+                try:
+                    ids = list(self.lookup[k].get(v, {}))
+                except TypeError:
+                    continue
+                return filter(None, (self._get(i) for i in ids))
+        return self.all()
+
+    def flush(self):
+        """ Force appended lines to disk
+        """
+        with self._lock:
+            for f in (self._data_f, self._index_f):
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _maybe_compact(self):
+        """ Compact once dead lines outweigh live ones
+        """
+        size = os.fstat(self._data_f.fileno()).st_size
+        if size >= COMPACT_MIN_SIZE and size - self.live > self.live:
+            self.compact()
+
+    def compact(self):
+        """ Rewrite the data file with live lines only, together with a
+        fresh side index; both are swapped in with atomic renames
+        """
+        with self._file_lock():
+            self._sync()
+            directory = path.dirname(self.file_path) or '.'
+            fd, data_tmp = tempfile.mkstemp(prefix=self.file_path + '.',
+                                            dir=directory)
+            fd_index, index_tmp = tempfile.mkstemp(
+                prefix=self.index_path + '.', dir=directory)
+            try:
+                with os.fdopen(fd, 'wb') as data_f, \
+                        os.fdopen(fd_index, 'w') as index_f:
+                    index_f.write(json.dumps(
+                        {'ino': os.fstat(data_f.fileno()).st_ino}) + '\n')
+                    offset = 0
+                    for obj_id in list(self.spans):
+                        line = (json.dumps(self._get(obj_id)) +
+                                '\n').encode('utf-8')
+                        data_f.write(line)
+                        index_f.write(json.dumps(
+                            [obj_id, offset, offset + len(line),
+                             list(self.values[obj_id])]) + '\n')
+                        offset += len(line)
+                # The index names the inode of its data file, so a crash
+                # between the two renames is detected by reload()
+                os.replace(data_tmp, self.file_path)
+                os.replace(index_tmp, self.index_path)
+            except BaseException:
+                for tmp in (data_tmp, index_tmp):
+                    if path.exists(tmp):
+                        os.remove(tmp)
+                raise
+            self._load()
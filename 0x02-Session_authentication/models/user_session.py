@@ -8,6 +8,9 @@ class UserSession(Base):
     ''' Extend behaviors of Base class for session authentication using a DB.
     '''
 
+    __slots__ = ('user_id', 'session_id')
+    INDEXES = ('session_id',)
+
     def __init__(self, *args: list, **kwargs: dict):
         ''' Initialize class instance. '''
         super().__init__(*args, **kwargs)